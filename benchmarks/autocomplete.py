@@ -0,0 +1,53 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+""" Compares autocomplete latency of the search index against the old linear scan.
+
+Run from the repository root with `PYTHONPATH=src python benchmarks/autocomplete.py [TITLES]`.
+"""
+import random
+import sys
+import time
+
+from soundtrack.internal.search import TrackSearch
+
+WORDS = ['battle', 'tavern', 'forest', 'dungeon', 'dragon', 'boss', 'calm', 'storm', 'night', 'city',
+         'ruins', 'chase', 'sea', 'crypt', 'castle', 'market', 'theme', 'ambience', 'elven', 'dwarven']
+QUERIES = ['', 'b', 'ba', 'bat', 'battle', 'dra', 'ragon', 'orm', 'night cas', 'zzz']
+
+
+def linear_scan(tracks: list, track: str):
+    """ The autocomplete used before the search index """
+    if not track:
+        return tracks
+    near_tracks = [t for t in tracks if t.lower().startswith(track.lower())]
+    if near_tracks == []:
+        near_tracks = [t for t in tracks if track.lower() in t.lower()]
+    return near_tracks
+
+
+def timeit(function, repeat: int = 20):
+    """ Best time of `repeat` calls, in milliseconds """
+    best = float('inf')
+    for _ in range(repeat):
+        t = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - t)
+    return best * 1000
+
+
+def main(count: int):
+    random.seed(0)
+    tracks = list({' '.join(random.choices(WORDS, k=random.randint(2, 4))).title() + f' {i}' for i in range(count)})
+
+    t = time.perf_counter()
+    search = TrackSearch(tracks)
+    print(f'{count} titles, index built in {(time.perf_counter() - t) * 1000:.0f} ms')
+    print(f'{"query":>12} {"scan ms":>9} {"index ms":>9}')
+    for query in QUERIES:
+        print(f'{query!r:>12} {timeit(lambda: linear_scan(tracks, query)):9.3f} {timeit(lambda: search.search(query)):9.3f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
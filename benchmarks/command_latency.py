@@ -0,0 +1,77 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+""" Measures how quickly `/stop` and `/play` take effect while a soundtrack is in its intro->loop delay.
+
+Run from the repository root with `PYTHONPATH=src python benchmarks/command_latency.py`.
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+from fakes import FakeVoiceClient, FakePCMAudio, write_ogg_opus
+from soundtrack.internal.player import GuildPlayer
+
+INTRO = 0.2
+DELAY = 2
+
+
+async def wait_for_frame(client: FakeVoiceClient, since: float, tag: bytes, timeout: float = 5):
+    """ Returns the time of the first packet starting with `tag` sent after `since` """
+    end = time.perf_counter() + timeout
+    while time.perf_counter() < end:
+        for t, first in client.log:
+            if t > since and first == tag:
+                return t
+        await asyncio.sleep(0.001)
+    return None
+
+
+async def measure(player: GuildPlayer, start):
+    """ Starts a soundtrack with `start()`, then issues `/stop` and `/play` inside its delay window """
+    results = {}
+    client = player.voice_client
+
+    start()
+    await asyncio.sleep(INTRO + DELAY / 2)
+    t0 = time.perf_counter()
+    player.stop()
+    await asyncio.sleep(0)
+    results['stop_ms'] = (time.perf_counter() - t0) * 1000
+    await asyncio.sleep(DELAY)
+    results['loop_started_after_stop'] = client.frames_since(t0, b'L') > 0
+
+    start()
+    await asyncio.sleep(INTRO + DELAY / 2)
+    t0 = time.perf_counter()
+    player.start_sequence('next', lambda: FakePCMAudio(1, b'N'), lambda: FakePCMAudio(1, b'N'))
+    first = await wait_for_frame(client, t0, b'N')
+    results['play_to_first_frame_ms'] = (first - t0) * 1000 if first else None
+    await asyncio.sleep(DELAY)
+    results['old_loop_started_after_play'] = client.frames_since(t0, b'L') > 0
+    player.stop()
+    return results
+
+
+async def main():
+    player = GuildPlayer()
+    player.voice_client = FakeVoiceClient(asyncio.get_running_loop())
+    with tempfile.TemporaryDirectory() as tmp:
+        intro = os.path.join(tmp, 'intro.mp3')
+        loop = os.path.join(tmp, 'loop.mp3')
+        write_ogg_opus(os.path.join(tmp, 'intro.opus'), INTRO, b'I')
+        write_ogg_opus(os.path.join(tmp, 'loop.opus'), 1, b'L')
+
+        gapless = await measure(player, lambda: player.start('gapless', intro, loop, DELAY))
+        fallback = await measure(player, lambda: player.start_sequence('fallback', lambda: FakePCMAudio(INTRO, b'I'), lambda: FakePCMAudio(1, b'L'), DELAY))
+
+    for name, results in (('gapless', gapless), ('fallback', fallback)):
+        print(f'{name}:')
+        for key, value in results.items():
+            print(f'    {key}: {value:.2f}' if isinstance(value, float) else f'    {key}: {value}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
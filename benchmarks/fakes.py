@@ -0,0 +1,162 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+""" Fakes for driving the player without connecting to Discord """
+import asyncio
+import struct
+import threading
+import time
+from types import SimpleNamespace
+
+import nextcord
+from nextcord.player import AudioPlayer
+
+FRAME_SIZE = 3840 # 20ms of 48kHz 16-bit stereo PCM
+
+
+class FakeVoiceWebSocket:
+    async def speak(self, state):
+        pass
+
+
+class FakeVoiceClient:
+    """ Stands in for `nextcord.VoiceClient`.
+
+    Sources are driven by nextcord's own `AudioPlayer` thread, so frame pacing matches the real
+    client, but packets are only recorded as `(time, first byte)` in `log` instead of being sent.
+    """
+    def __init__(self, loop, channel=None):
+        self.loop = loop
+        self.channel = channel
+        self.ws = FakeVoiceWebSocket()
+        self.log = []
+        self._connected = threading.Event()
+        self._connected.set()
+        self._player = None
+        # Like the real client, which only creates an encoder when it first plays PCM
+        self.encoder = nextcord.utils.MISSING
+
+    def send_audio_packet(self, data: bytes, *, encode: bool = True):
+        self.log.append((time.perf_counter(), bytes(data[:1])))
+
+    def play(self, source, *, after=None):
+        if not self.is_connected():
+            raise nextcord.errors.ClientException('Not connected to voice.')
+        if self.is_playing():
+            raise nextcord.errors.ClientException('Already playing audio.')
+        self._player = AudioPlayer(source, self, after=after)
+        self._player.start()
+
+    @property
+    def source(self):
+        return self._player.source if self._player else None
+
+    @source.setter
+    def source(self, value):
+        self._player._set_source(value)
+
+    def is_connected(self):
+        return self._connected.is_set()
+
+    def is_playing(self):
+        return self._player != None and self._player.is_playing()
+
+    def is_paused(self):
+        return self._player != None and self._player.is_paused()
+
+    def pause(self):
+        if self._player:
+            self._player.pause()
+
+    def resume(self):
+        if self._player:
+            self._player.resume()
+
+    def stop(self):
+        if self._player:
+            self._player.stop()
+            self._player = None
+
+    async def move_to(self, channel):
+        self.channel = channel
+
+    async def disconnect(self, *, force: bool = False):
+        self.stop()
+        self._connected.clear()
+
+    def frames_since(self, since: float, tag: bytes = None):
+        """ Number of packets sent after `since`, optionally only those starting with `tag` """
+        return sum(1 for t, first in self.log if t > since and (tag == None or first == tag))
+
+
+class FakePCMAudio(nextcord.AudioSource):
+    """ `seconds` of PCM frames all filled with the byte `tag` """
+    def __init__(self, seconds: float, tag: bytes = b'\x00'):
+        self._frames = int(seconds * 50)
+        self._frame = tag * FRAME_SIZE
+
+    def read(self):
+        if self._frames <= 0:
+            return b''
+        self._frames -= 1
+        return self._frame
+
+
+def write_ogg_opus(path: str, seconds: float, tag: bytes):
+    """ Writes an Ogg file of `seconds` worth of dummy 20ms "Opus" packets starting with `tag` """
+    def page(packets):
+        segments = b''.join(bytes([255] * (len(p) // 255) + [len(p) % 255]) for p in packets)
+        return b'OggS' + struct.pack('<xBQIIIB', 0, 0, 1, 0, 0, len(segments)) + segments + b''.join(packets)
+    with open(path, 'wb') as file:
+        file.write(page([b'OpusHead' + bytes(11)]))
+        file.write(page([b'OpusTags' + bytes(8)]))
+        packets = [tag + bytes(160)] * int(seconds * 50)
+        for i in range(0, len(packets), 100):
+            file.write(page(packets[i:i + 100]))
+
+
+class FakeChannel:
+    """ A voice channel whose `connect()` returns a `FakeVoiceClient` """
+    def __init__(self, guild, members: list = None):
+        self.guild = guild
+        self.members = members if members != None else []
+
+    async def connect(self, *, reconnect: bool = True, **kwargs):
+        return FakeVoiceClient(asyncio.get_running_loop(), self)
+
+
+class FakeGuild:
+    def __init__(self, id: int):
+        self.id = id
+        self.name = f'Guild {id}'
+
+    async def change_voice_state(self, **kwargs):
+        pass
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def defer(self, **kwargs):
+        pass
+
+    async def send_autocomplete(self, choices):
+        self.interaction.sent.append(choices)
+
+
+class FakeInteraction:
+    """ Stands in for `nextcord.Interaction`: a user in `channel`, with everything sent kept in `sent` """
+    def __init__(self, guild: FakeGuild, channel: FakeChannel = None, roles: list = ()):
+        self.guild = guild
+        voice = SimpleNamespace(channel=channel, mute=False, suppress=False) if channel else None
+        self.user = SimpleNamespace(voice=voice, roles=list(roles), bot=False)
+        self.response = FakeResponse(self)
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(content)
+
+    async def edit_original_message(self, *, content=None, **kwargs):
+        self.sent.append(content)
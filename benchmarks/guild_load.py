@@ -0,0 +1,75 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+""" Drives many guild players at once on one event loop and reports event-loop lag.
+
+Run from the repository root with `PYTHONPATH=src python benchmarks/guild_load.py [GUILDS] [SECONDS]`.
+"""
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from fakes import FakeVoiceClient, write_ogg_opus
+from soundtrack.internal.player import get_player, players
+
+TICK = 0.005
+
+
+async def measure_lag(samples: list, stop: asyncio.Event):
+    """ Appends how late each `TICK` sleep wakes up, in milliseconds """
+    while not stop.is_set():
+        t = time.perf_counter()
+        await asyncio.sleep(TICK)
+        samples.append((time.perf_counter() - t - TICK) * 1000)
+
+
+async def drive(guild_id: int, tracks: list, seconds: float, stats: list):
+    """ Plays random tracks in one guild, switching every few seconds like a busy table """
+    player = get_player(guild_id)
+    player.voice_client = FakeVoiceClient(asyncio.get_running_loop())
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        intro, loop = random.choice(tracks)
+        player.start(f'track {guild_id}', intro, loop, random.randint(0, 1))
+        stats.append(player.stats)
+        await asyncio.sleep(random.uniform(1, 3))
+    player.stop()
+    return len(player.voice_client.log)
+
+
+async def main(guilds: int, seconds: float):
+    with tempfile.TemporaryDirectory() as tmp:
+        tracks = []
+        for i in range(5):
+            intro = os.path.join(tmp, f'intro{i}.mp3')
+            loop = os.path.join(tmp, f'loop{i}.mp3')
+            write_ogg_opus(os.path.join(tmp, f'intro{i}.opus'), 2, b'I')
+            write_ogg_opus(os.path.join(tmp, f'loop{i}.opus'), 10, b'L')
+            tracks.append((intro, loop))
+
+        lag = []
+        stop = asyncio.Event()
+        lag_task = asyncio.create_task(measure_lag(lag, stop))
+        started = time.perf_counter()
+        stats = []
+        frames = await asyncio.gather(*(drive(g, tracks, seconds, stats) for g in range(guilds)))
+        stop.set()
+        await lag_task
+        elapsed = time.perf_counter() - started
+
+    lag.sort()
+    print(f'guilds: {len(players)}')
+    print(f'frames sent: {sum(frames)} ({sum(frames) / elapsed / guilds:.1f}/s per guild, 50/s while playing)')
+    print(f'event loop lag ms: mean {statistics.mean(lag):.2f}, p99 {lag[int(len(lag) * 0.99)]:.2f}, max {lag[-1]:.2f}')
+    late = sum(s.late for s in stats)
+    print(f'late frames: {late} ({late / max(1, sum(frames)) * 100:.2f}%), worst {max(s.worst_late for s in stats) * 1000:.1f} ms')
+    print(f'underruns: {sum(s.underruns for s in stats)}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 32, float(sys.argv[2]) if len(sys.argv) > 2 else 10))
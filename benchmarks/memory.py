@@ -0,0 +1,86 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+""" Measures the memory used by several sessions playing the same long loop, with its packets read into memory or memory mapped.
+
+Each mode runs in a fresh process so the numbers don't mix. `copies` has every session load its own packet
+list (a loop too big for the packet cache), `shared` shares one list through the cache, `mmap` maps the file.
+Heap memory is owned by the process; file memory is the file's pages in the page cache, which every
+process mapping the file shares and the kernel can drop and read again under memory pressure.
+
+Run from the repository root with `PYTHONPATH=src python benchmarks/memory.py [SESSIONS] [MINUTES]`.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from fakes import write_ogg_opus
+
+MODES = ('copies', 'shared', 'mmap')
+
+
+def memory():
+    """ Resident, heap (anonymous) and file-backed memory of this process in MiB, from /proc/self/smaps_rollup """
+    fields = {}
+    with open('/proc/self/smaps_rollup') as file:
+        for line in file:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {
+        'rss': fields['Rss'],
+        'heap': fields['Anonymous'],
+        'file': fields['Rss'] - fields['Anonymous'],
+    }
+
+
+def run(mode: str, tmp: str, sessions: int):
+    """ Plays the loop in `tmp` from start to end in `sessions` sessions, prints memory before and after as `name value` lines """
+    from soundtrack.internal import audio
+    from soundtrack.internal.cache import packet_cache
+
+    if mode != 'mmap':
+        audio.MMAP_SIZE = float('inf')
+    if mode == 'copies':
+        packet_cache.resize(0)
+    before = memory()
+    started = time.perf_counter()
+    playing = [audio.SoundtrackAudio(os.path.join(tmp, 'intro.mp3'), os.path.join(tmp, 'loop.mp3'), loops=1) for _ in range(sessions)]
+    loaded = time.perf_counter() - started
+    frames = 0
+    started = time.perf_counter()
+    for source in playing:
+        while source.read():
+            frames += 1
+    elapsed = time.perf_counter() - started
+    after = memory()
+    for name in after:
+        print(name, after[name] - before[name])
+    print('load', loaded)
+    print('read', elapsed / frames * 1e6)
+
+
+def main(sessions: int, minutes: float):
+    with tempfile.TemporaryDirectory() as tmp:
+        write_ogg_opus(os.path.join(tmp, 'intro.opus'), 2, b'I')
+        write_ogg_opus(os.path.join(tmp, 'loop.opus'), minutes * 60, b'L')
+        size = os.path.getsize(os.path.join(tmp, 'loop.opus')) / 1024 / 1024
+        print(f'{sessions} sessions playing a {minutes:g} minute loop ({size:.1f} MiB Opus file) to the end')
+        print(f'{"mode":8} {"rss MiB":>9} {"heap":>9} {"file":>9} {"load ms":>9} {"µs/frame":>9}')
+        for mode in MODES:
+            output = subprocess.run(
+                [sys.executable, __file__, '--run', mode, tmp, str(sessions)],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            result = {name: float(value) for name, value in (line.split() for line in output.splitlines())}
+            print(f'{mode:8} {result["rss"]:9.1f} {result["heap"]:9.1f} {result["file"]:9.1f} {result["load"] * 1000:9.1f} {result["read"]:9.2f}')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--run':
+        run(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 8, float(sys.argv[2]) if len(sys.argv) > 2 else 60)
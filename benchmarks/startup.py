@@ -0,0 +1,56 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+""" Wall-clock time of the informational CLI commands, and what they import.
+
+Run from the repository root with `PYTHONPATH=src python benchmarks/startup.py [--importtime]`.
+`--importtime` also prints the 10 slowest imports of `-d` as reported by `python -X importtime`.
+"""
+import os
+import subprocess
+import sys
+import time
+
+COMMANDS = [['-h'], ['-v'], ['-c'], ['-d']]
+RUNS = 10
+
+
+def run(args: list):
+    """ Best wall-clock time of `python -m soundtrack *args` over `RUNS` runs, in milliseconds """
+    best = float('inf')
+    for _ in range(RUNS):
+        t = time.perf_counter()
+        subprocess.run([sys.executable, '-m', 'soundtrack', *args], check=True, stdout=subprocess.DEVNULL, env=os.environ)
+        best = min(best, time.perf_counter() - t)
+    return best * 1000
+
+
+def main():
+    baseline = run_python()
+    print(f'{"python -c pass":>24}: {baseline:6.1f} ms')
+    for args in COMMANDS:
+        print(f'{"soundtrack " + " ".join(args):>24}: {run(args):6.1f} ms')
+
+    if '--importtime' in sys.argv:
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-m', 'soundtrack', '-d'], capture_output=True, text=True, env=os.environ)
+        imports = []
+        for line in result.stderr.splitlines()[1:]:
+            self_us, cumulative, name = line.removeprefix('import time:').split('|')
+            imports.append((int(cumulative), name.strip()))
+        print('slowest imports of -d (cumulative us):')
+        for cumulative, name in sorted(imports, reverse=True)[:10]:
+            print(f'    {cumulative:8d} {name}')
+
+
+def run_python():
+    best = float('inf')
+    for _ in range(RUNS):
+        t = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+        best = min(best, time.perf_counter() - t)
+    return best * 1000
+
+
+if __name__ == '__main__':
+    main()
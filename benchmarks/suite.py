@@ -0,0 +1,292 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+""" Runs the performance benchmarks against fake Discord interactions and voice clients, and prints the results as JSON.
+
+The bot module is imported for real, with its config and data directories pointed at a
+temporary directory, and its slash commands are called with fake interactions.
+
+Run from the repository root with `PYTHONPATH=src python benchmarks/suite.py [--quick] [--output FILE]`.
+"""
+import asyncio
+import contextlib
+import importlib.metadata
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from fakes import FakeChannel, FakeGuild, FakeInteraction, write_ogg_opus, FakePCMAudio, FakeVoiceClient
+from autocomplete import WORDS, QUERIES
+
+QUICK = '--quick' in sys.argv
+LIBRARY_SIZES = [1000, 10000] if QUICK else [1000, 10000, 50000]
+RUNS = 5 if QUICK else 20
+BATCH = 50 # soundtracks renamed in one batch of edits
+
+
+def percentiles(samples: list):
+    """ p50, p99 and max of `samples` (seconds), in milliseconds """
+    samples = sorted(samples)
+    return {
+        'p50_ms': samples[len(samples) // 2] * 1000,
+        'p99_ms': samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000,
+        'max_ms': samples[-1] * 1000,
+    }
+
+
+def titles(count: int):
+    random.seed(count)
+    return [' '.join(random.choices(WORDS, k=random.randint(2, 4))).title() + f' {i}' for i in range(count)]
+
+
+async def wait_for(predicate, timeout: float = 5):
+    end = time.perf_counter() + timeout
+    while not predicate():
+        if time.perf_counter() > end:
+            raise TimeoutError
+        await asyncio.sleep(0.0005)
+
+
+def frame_gaps(log: list, first: bytes, then: bytes):
+    """ Gaps between consecutive frames, and the gap where frames tagged `first` give way to `then`, in milliseconds """
+    gaps = [(b[0] - a[0]) * 1000 for a, b in zip(log, log[1:])]
+    boundary = [gap for gap, a, b in zip(gaps, log, log[1:]) if a[1] == first and b[1] == then]
+    return gaps, boundary
+
+
+async def bench_play(bot, guild_id: int):
+    """ /play to first frame through the real slash command, and the frame gaps at the intro->loop and loop->loop boundaries """
+    intro = os.path.join(bot.TRACK_PATH, 'bench-intro.mp3')
+    loop = os.path.join(bot.TRACK_PATH, 'bench-loop.mp3')
+    write_ogg_opus(os.path.join(bot.TRACK_PATH, 'bench-intro.opus'), 0.5, b'I')
+    write_ogg_opus(os.path.join(bot.TRACK_PATH, 'bench-loop.opus'), 0.5, b'L')
+    # Stand-ins for the source files, played from the .opus files next to them
+    for path in (intro, loop):
+        with open(path, 'wb') as file:
+            file.write(b'ID3')
+    bot.index['Bench'] = {'intro': intro, 'loop': loop, 'delay': 0}
+    bot.refresh_tracks()
+
+    guild = FakeGuild(guild_id)
+    channel = FakeChannel(guild)
+    budget = bot.packet_cache.budget
+    first_frame = {}
+    # With the packet cache disabled every play reads the files again
+    for name, size in (('uncached', 0), ('cached', budget)):
+        bot.packet_cache.resize(size)
+        first_frame[name] = []
+        for _ in range(RUNS):
+            interaction = FakeInteraction(guild, channel)
+            t = time.perf_counter()
+            await bot.play.callback(interaction, track='Bench')
+            player = bot.get_player(guild_id)
+            await wait_for(lambda: any(at > t for at, tag in player.voice_client.log))
+            first_frame[name].append(next(at for at, tag in player.voice_client.log if at > t) - t)
+            player.stop()
+            player.voice_client.log.clear()
+
+    # Let it loop a few times, then compare the boundaries with ordinary frame spacing
+    interaction = FakeInteraction(guild, channel)
+    await bot.play.callback(interaction, track='Bench')
+    await asyncio.sleep(2.2)
+    player.stop()
+    gaps, into_loop = frame_gaps(player.voice_client.log, b'I', b'L')
+    gaps, loop_wrap = frame_gaps(player.voice_client.log, b'L', b'L')
+
+    # The FFmpeg fallback plays intro and each loop iteration as separate sources
+    fallback = FakeVoiceClient(asyncio.get_running_loop(), channel)
+    player.voice_client = fallback
+    player.start_sequence('Bench', lambda: FakePCMAudio(0.5, b'I'), lambda: FakePCMAudio(0.5, b'F'), 0)
+    await asyncio.sleep(2.2)
+    player.stop()
+    fallback_gaps, fallback_boundaries = frame_gaps(fallback.log, b'F', b'F')
+    fallback_into_loop = frame_gaps(fallback.log, b'I', b'F')[1]
+
+    bot.release(bot.index, bot.index.pop('Bench'))
+    bot.refresh_tracks()
+    return {
+        'time_to_first_frame': percentiles(first_frame['cached']),
+        'time_to_first_frame_uncached': percentiles(first_frame['uncached']),
+        'frame_gap_ms': {'median': statistics.median(gaps), 'max': max(gaps)},
+        'intro_to_loop_gap_ms': max(into_loop),
+        'loop_boundary_gap_ms': max(loop_wrap),
+        'fallback_intro_to_loop_gap_ms': max(fallback_into_loop),
+        'fallback_loop_boundary_gap_ms': max(fallback_boundaries),
+    }
+
+
+async def bench_queue(bot, guild_id: int):
+    """ /queue next to the first frame of the next soundtrack, and the gap where a queued soundtrack follows one that ended """
+    for title, tag in (('Queue A', b'A'), ('Queue B', b'B')):
+        entry = {}
+        for part, part_tag in (('intro', tag), ('loop', tag.lower())):
+            path = os.path.join(bot.TRACK_PATH, f'bench-{tag.decode()}-{part}.mp3')
+            write_ogg_opus(os.path.join(bot.TRACK_PATH, f'bench-{tag.decode()}-{part}.opus'), 0.5, part_tag)
+            with open(path, 'wb') as file:
+                file.write(b'ID3')
+            entry[part] = path
+        bot.index[title] = entry | {'delay': 0}
+        bot.update_track(title)
+
+    guild = FakeGuild(guild_id)
+    channel = FakeChannel(guild)
+    await bot.play.callback(FakeInteraction(guild, channel), track='Queue A')
+    player = bot.get_player(guild_id)
+    await wait_for(lambda: player.voice_client.log)
+
+    # Skipping to a queued soundtrack
+    await bot.queue_add.callback(FakeInteraction(guild, channel), track='Queue B', loops=1)
+    await wait_for(lambda: player._following != None)
+    interaction = FakeInteraction(guild, channel)
+    t = time.perf_counter()
+    await bot.queue_next.callback(interaction)
+    await wait_for(lambda: any(at > t and tag == b'B' for at, tag in player.voice_client.log))
+    skip = next(at for at, tag in player.voice_client.log if at > t and tag == b'B') - t
+    assert player.track == 'Queue B' and not player.queue, (player.track, player.queue, interaction.sent)
+
+    # Queue B plays its one loop, then Queue A follows on its own
+    await bot.queue_add.callback(FakeInteraction(guild, channel), track='Queue A', loops=None)
+    await wait_for(lambda: any(tag == b'A' and at > t for at, tag in player.voice_client.log))
+    assert player.track == 'Queue A', player.track
+    handover = frame_gaps([entry for entry in player.voice_client.log if entry[0] > t], b'b', b'A')[1]
+    player.stop()
+
+    for title in ('Queue A', 'Queue B'):
+        bot.release(bot.index, bot.index.pop(title))
+        bot.update_track(title)
+    return {
+        'queue_next_to_first_frame_ms': skip * 1000,
+        'queue_handover_gap_ms': max(handover),
+    }
+
+
+async def bench_autocomplete(bot, guild_id: int):
+    """ Autocomplete latency through the real autocomplete handler, against library size """
+    from soundtrack.internal.search import TrackSearch
+    results = {}
+    saved = bot.track_search
+    for size in LIBRARY_SIZES:
+        bot.track_search = TrackSearch(titles(size))
+        samples = []
+        for _ in range(RUNS):
+            for query in QUERIES:
+                interaction = FakeInteraction(FakeGuild(guild_id))
+                t = time.perf_counter()
+                await bot.track_autocomplete(interaction, query)
+                samples.append(time.perf_counter() - t)
+        results[str(size)] = percentiles(samples)
+    bot.track_search = saved
+    return results
+
+
+def bench_batch(index, size: int):
+    """ Seconds to rename `size` soundtracks back and forth and write them to disk """
+    t = time.perf_counter()
+    for i in range(size):
+        index.rename(f'new {i}', f'renamed {i}')
+    for i in range(size):
+        index.rename(f'renamed {i}', f'new {i}')
+    index.flush()
+    return time.perf_counter() - t
+
+
+def bench_index(track_path: str):
+    """ Cost of adding, renaming and deleting one soundtrack, against library size, and of a batch of renames written through or behind """
+    from soundtrack.internal.index import SqliteTrackIndex
+    results = {}
+    for size in LIBRARY_SIZES:
+        path = os.path.join(track_path, f'bench-{size}.db')
+        index = SqliteTrackIndex(path)
+        index.put_many({title: {'intro': f'{i}a.mp3', 'loop': f'{i}b.mp3', 'delay': 0} for i, title in enumerate(titles(size))})
+        samples = {'add': [], 'rename': [], 'delete': []}
+        for i in range(RUNS):
+            t = time.perf_counter()
+            index[f'new {i}'] = {'intro': 'x.mp3', 'loop': 'y.mp3', 'delay': 0}
+            samples['add'].append(time.perf_counter() - t)
+            t = time.perf_counter()
+            index.rename(f'new {i}', f'renamed {i}')
+            samples['rename'].append(time.perf_counter() - t)
+            t = time.perf_counter()
+            index.pop(f'renamed {i}')
+            samples['delete'].append(time.perf_counter() - t)
+        index.put_many({f'new {i}': {'intro': 'x.mp3', 'loop': 'y.mp3', 'delay': 0} for i in range(BATCH)})
+        batch = {}
+        for name, delay in (('batch_written_through_ms', 0), ('batch_written_behind_ms', 60)):
+            index.delay = delay
+            batch[name] = bench_batch(index, BATCH) * 1000
+        t = time.perf_counter()
+        index.close()
+        SqliteTrackIndex(path).close()
+        load = time.perf_counter() - t
+        results[str(size)] = {op: percentiles(s) for op, s in samples.items()} | batch | {'load_ms': load * 1000}
+    return results
+
+
+async def bench_upload(track_path: str):
+    """ Throughput of streaming and hashing two concurrent downloads to disk """
+    from upload import FakeAttachment, measure
+    from aiohttp import web
+    import aiohttp
+    from soundtrack.internal.ingest import download
+    megabytes = 10 if QUICK else 50
+    payload = os.urandom(megabytes * 1024 * 1024)
+    async def serve(request):
+        return web.Response(body=payload)
+    app = web.Application()
+    app.router.add_get('/{name}', serve)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    async def streaming():
+        async with aiohttp.ClientSession() as session:
+            await asyncio.gather(*(download(session, f'http://127.0.0.1:{port}/{n}', os.path.join(track_path, f'{n}.part')) for n in ('intro', 'loop')))
+    elapsed, lag = await measure(streaming)
+    await runner.cleanup()
+    return {'megabytes': 2 * megabytes, 'seconds': elapsed, 'mb_per_second': 2 * megabytes / elapsed, 'max_event_loop_lag_ms': lag}
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['XDG_CONFIG_HOME'] = os.path.join(tmp, 'config')
+        os.environ['XDG_DATA_HOME'] = os.path.join(tmp, 'data')
+        os.makedirs(os.path.join(tmp, 'config', 'soundtrack'))
+        with open(os.path.join(tmp, 'config', 'soundtrack', 'config.yml'), 'w') as file:
+            json.dump({'guild': '1', 'token': 'benchmark', 'client_id': '1', 'role': '1', 'locked': False}, file)
+        # Keep stdout for the JSON results, the bot logs to it while importing
+        with contextlib.redirect_stdout(sys.stderr):
+            from soundtrack import bot
+        from logging42 import logger
+        logger.remove()
+        logger.add(sys.stderr, level='WARNING')
+
+        results = {
+            'version': importlib.metadata.version('soundtrack'),
+            'python': platform.python_version(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'quick': QUICK,
+            'play': await bench_play(bot, 1),
+            'queue': await bench_queue(bot, 2),
+            'autocomplete': await bench_autocomplete(bot, 1),
+            'index': bench_index(tmp),
+            'upload': await bench_upload(tmp),
+        }
+        bot.index.close()
+
+    output = json.dumps(results, indent=2)
+    if '--output' in sys.argv:
+        with open(sys.argv[sys.argv.index('--output') + 1], 'w') as file:
+            file.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,93 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+""" Wall-clock time and event-loop lag of downloading an upload's pair of attachments.
+
+Compares nextcord's `Attachment.save()` one after the other (the old upload) with the concurrent
+streaming download of the ingest pipeline, against a local HTTP server.
+Probing and encoding are left out, they need real audio and FFmpeg.
+
+Run from the repository root with `PYTHONPATH=src python benchmarks/upload.py [MEGABYTES]`.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+from soundtrack.internal.ingest import download
+
+TICK = 0.005
+
+
+class FakeAttachment:
+    """ Minimal `nextcord.Attachment`: `save()` reads the whole file into memory first, like nextcord's """
+    def __init__(self, url: str, size: int):
+        self.url = url
+        self.size = size
+
+    async def save(self, path: str):
+        async with aiohttp.ClientSession() as session:
+            async with session.get(self.url) as response:
+                data = await response.read()
+        with open(path, 'wb') as file:
+            file.write(data)
+
+
+async def measure(function):
+    """ Runs `function()`, returns its wall-clock time and the worst event-loop lag meanwhile, in seconds and ms """
+    lag = [0]
+    done = asyncio.Event()
+    async def watch():
+        while not done.is_set():
+            t = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lag.append((time.perf_counter() - t - TICK) * 1000)
+    watcher = asyncio.create_task(watch())
+    start = time.perf_counter()
+    await function()
+    elapsed = time.perf_counter() - start
+    done.set()
+    await watcher
+    return elapsed, max(lag)
+
+
+async def main(megabytes: int):
+    payload = os.urandom(megabytes * 1024 * 1024)
+    async def serve(request):
+        response = web.StreamResponse()
+        response.content_length = len(payload)
+        await response.prepare(request)
+        for i in range(0, len(payload), 64 * 1024):
+            await response.write(payload[i:i + 64 * 1024])
+        return response
+    app = web.Application()
+    app.router.add_get('/{name}', serve)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    intro = FakeAttachment(f'http://127.0.0.1:{port}/intro.mp3', len(payload))
+    loop = FakeAttachment(f'http://127.0.0.1:{port}/loop.mp3', len(payload))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [os.path.join(tmp, 'intro.mp3'), os.path.join(tmp, 'loop.mp3')]
+        async def sequential():
+            await intro.save(paths[0])
+            await loop.save(paths[1])
+        async def streaming():
+            async with aiohttp.ClientSession() as session:
+                await asyncio.gather(*(download(session, a.url, p) for a, p in zip((intro, loop), paths)))
+        for name, function in (('save() sequential', sequential), ('streaming concurrent', streaming)):
+            elapsed, lag = await measure(function)
+            print(f'{name:>22}: {elapsed:.2f}s for 2 x {megabytes} MB, max event loop lag {lag:.1f} ms')
+    await runner.cleanup()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 50))
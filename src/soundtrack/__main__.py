@@ -2,26 +2,13 @@
 # Soundtrack 
 # Copyright (c) 2023 Krafter Developer
 # 
-from logging42 import logger
-
 import os
 import sys
-import yaml
-import uuid
-import time
-import importlib.metadata
-from typing import Optional
-
-from xdg import BaseDirectory
-import nextcord
-from nextcord.ext import commands, tasks
 
-from .internal.util import auto_configure, get_invite_url
-from .internal import messages
-
-PACKAGE_NAME = 'soundtrack'
+from .internal.util import PACKAGE_NAME, CONFIG_PATH, DATA_PATH
 
 # CLI
+# Only what a command needs is imported, the Discord stack is only loaded to run the bot
 if '--help' in sys.argv or '-h' in sys.argv:
     page = [
         'Usage: python3 -m soundtrack [--reconfigure]',
@@ -31,6 +18,12 @@ if '--help' in sys.argv or '-h' in sys.argv:
         '-i, --invite   : Generate the URL for Inviting the bot (Use `-i` for just the URL)',
         '-c, --config   : Print the path of the Configuration File',
         '-d, --data     : Print the path of the Data Directory (where tracks are stored)',
+        '--gc           : Remove track files no soundtrack uses anymore',
+        '--import PATH  : Import soundtracks from a directory (`<title>/intro.mp3`, `<title>/loop.mp3`), a manifest or an `--export` archive; stop the bot first',
+        '--export FILE  : Write every soundtrack to a portable archive',
+        '--verify       : Check that every track file is there and undamaged (by its checksum)',
+        '--analyze      : Measure the loudness of every track (re-encoding them if `normalize` is set); stop the bot first',
+        '--stats        : Print the metrics of the running bot (requires `metrics_port` in the config)',
         '--reconfigure  : Re-run interactive configuration',
         '--verbose      : Show debugging Log messages',
         ' ',
@@ -39,12 +32,14 @@ if '--help' in sys.argv or '-h' in sys.argv:
         '1  : Unknown Error',
         '10 : Config or API Error',
         '20 : Config Error',
+        '30 : Damaged Library (`--verify`)',
         '69 : Nice.'
     ]
     for i in page:
         print(i)
     sys.exit(0)
 elif '--version' in sys.argv or '-v' in sys.argv:
+    import importlib.metadata
     page = [
         f'🎜 Soundtrack v{importlib.metadata.version(PACKAGE_NAME)}',
         'Copyright (c) 2023 Krafter Developer, et al.',
@@ -55,9 +50,10 @@ elif '--version' in sys.argv or '-v' in sys.argv:
         print(i)
     sys.exit(0)
 elif '--invite' in sys.argv or '-i' in sys.argv:
-    path = os.path.join(BaseDirectory.xdg_config_home, 'soundtrack', 'config.yml')
-    if os.path.exists(path):
-        with open(path, "r") as file:
+    if os.path.exists(CONFIG_PATH):
+        import yaml
+        from .internal.util import get_invite_url
+        with open(CONFIG_PATH, "r") as file:
             cfg = yaml.full_load(file)
         if '-i' in sys.argv:
             print(get_invite_url(cfg["client_id"]))
@@ -78,460 +74,99 @@ elif '--invite' in sys.argv or '-i' in sys.argv:
         for i in page:
             print(i)
         sys.exit(20)
-elif '--configure' in sys.argv or '-c' in sys.argv:
-    print(os.path.join(BaseDirectory.xdg_config_home, 'soundtrack', 'config.yml'))
+elif '--config' in sys.argv or '--configure' in sys.argv or '-c' in sys.argv:
+    print(CONFIG_PATH)
     sys.exit(0)
 elif '--data' in sys.argv or '-d' in sys.argv:
-    print(os.path.join(BaseDirectory.xdg_data_home, 'soundtrack', ''))
+    print(os.path.join(DATA_PATH, ''))
     sys.exit(0)
-
-if not '--verbose' in sys.argv:
-    logger.remove(1)
-    logger.add(sys.stdout, level="INFO")
-
-logger.debug('Starting...')
-
-# Bot Definition
-intents = nextcord.Intents.default()
-intents.guilds = True
-intents.voice_states = True
-intents.members = True
-bot = commands.Bot(intents=intents)
-
-# Load Config
-config = None
-config_dir = os.path.join(BaseDirectory.xdg_config_home, 'soundtrack')
-config_path = os.path.join(config_dir, 'config.yml')
-
-os.makedirs(f"{config_dir}", exist_ok=True)
-
-default_config = {
-    "guild": None,
-    "token": None,
-    "client_id": None,
-    "role": None,
-}
-
-if os.path.exists(config_path) and not '--reconfigure' in sys.argv:
-    with open(config_path, "r") as file:
-        config = yaml.full_load(file)
-else:
-    config = auto_configure()
-    if config == None:
-        if not '--reconfigure' in sys.argv:
-            logger.critical(f'Configuration file does not exist!\n -> You must either run interactive configuration, or copy an existing configuration file to {config_path}.')
-        sys.exit(10)
-    else:
-        with open(config_path, "w") as file:
-            yaml.dump(config, file)
-        logger.info('Configuration complete!')
-
-# Global Variables
-TRACK_PATH = os.path.join(BaseDirectory.xdg_data_home, 'soundtrack')
-
-guild = None
-role = None
-requests = 0
-voice_client = None
-stop_when_looped = False
-block_disconnect = False
-latest_track = None
-
-## Refreshable global variables
-index = None
-tracks = []
-phases = {}
-
-## Refreshing functions
-def refresh_index(also_tracks=True):
-    """ Refreshes the `index` global variable (track index) """
-    global index
-    global TRACK_PATH
-    try:
-        with open(os.path.join(TRACK_PATH, 'index.yml'), "r") as file:
-            index = yaml.full_load(file)
-        if index == None:
-            index = {}
-    except FileNotFoundError:
-        index = None
-        logger.warning("🎜 Could not find track index! If you do not have any tracks added yet, this file will be created when you add one.")
-        return
-    logger.debug('Refreshed the track index from disk')
-
-    if also_tracks:
-        refresh_tracks()
-
-def refresh_tracks():
-    """ Refreshes the `tracks` global variable (track list) """
-    global tracks
-    global index
-    tracks = [name for name in index]
-    logger.debug('Refreshed the list of tracks from the track index')
-
-def refresh_phases():
-    """ Refreshes the `phases` global variable (phase list) """
-    global tracks
-    global index
-    global phases
-    phases = {}
-    for track in tracks:
-        if 'phases' in index[track]:
-            for phase in index[track]['phases']:
-                if track in phases:
-                    phases[track].append(phase)
-                else:
-                    phases[track] = [phase]
-
-# Initial load
-refresh_index()
-refresh_tracks()
-refresh_phases()
-
-data_dir = os.path.join(BaseDirectory.xdg_data_home, 'soundtrack')
-os.makedirs(f"{data_dir}", exist_ok=True)
-os.makedirs(TRACK_PATH, exist_ok=True)
-
-# Events
-@bot.event
-async def on_ready():
-    """ On Ready Event """
-    global config
-    msg = [
-        " ",
-        " --------------------",
-        f" 🎜 Soundtrack v{importlib.metadata.version(PACKAGE_NAME)}",
-        "    © 2023 Krafter",
-        "    MIT License",
-        " --------------------",
-        " ",
-    ]
-    for i in msg:
-        logger.info(i)
-    logger.debug(f'Logged in as {bot.user}')
-    
-    global guild
-    global role
-    global config_path
-    try:
-        guild = bot.get_guild(int(config["guild"]))
-        if guild == None:
-            raise ValueError('Guild is None')
-        logger.success(f'Connected with Guild: {guild.name} (ID: {guild.id})')
-        try:
-            role = guild.get_role(int(config["role"]))
-            if role == None:
-                raise ValueError('Role is None')
-            logger.success(f'Connected with Role: {role.name} (ID: {role.id})')
-        except ValueError:
-            logger.warning(f'Could not fetch role with ID {config["role"]}! Edit {config_path} or run with `--reconfigure`.')
-    except ValueError:
-        logger.warning(f'Could not fetch guild with ID {config["guild"]}! Edit {config_path} or run with `--reconfigure`.')
-    
-    if guild in bot.guilds:
-        logger.success(f'Connected and ready to use!')
-    else:
-        logger.success(f'Invite to your Guild: {get_invite_url(config["client_id"])}')
-
-    if 'locked' in config:
-        if not config['locked']:
-            logger.info('Soundtrack is not guild-locked!')
+elif '--gc' in sys.argv:
+    if not os.path.exists(DATA_PATH):
+        sys.exit(0)
+    from .internal.index import open_index
+    from .internal.storage import collect_garbage
+    removed = collect_garbage(open_index(DATA_PATH), DATA_PATH)
+    for i in removed:
+        print(f'Removed {i}')
+    print(f'🎜 Removed {len(removed)} unused track files.')
+    sys.exit(0)
+elif '--import' in sys.argv or '--export' in sys.argv:
+    option = '--import' if '--import' in sys.argv else '--export'
+    if sys.argv.index(option) + 1 >= len(sys.argv):
+        print(f'Usage: python3 -m soundtrack {option} PATH')
+        sys.exit(20)
+    path = sys.argv[sys.argv.index(option) + 1]
+    import yaml
+    from .internal.index import open_index
+    os.makedirs(DATA_PATH, exist_ok=True)
+    index = open_index(DATA_PATH)
+    if option == '--export':
+        from .internal.library import export_library
+        count = export_library(index, path)
+        print(f'🎜 Exported {count} soundtracks to {path}')
     else:
-        for g in bot.guilds:
-            if g != guild:
-                await g.leave()
-
-    global task
-    if not task.is_running():
-        await task.start()
+        from .internal.library import import_path
+        if not os.path.exists(path):
+            print(f'{path} does not exist!')
+            sys.exit(20)
+        cfg = {}
+        if os.path.exists(CONFIG_PATH):
+            with open(CONFIG_PATH, "r") as file:
+                cfg = yaml.full_load(file) or {}
+        imported, skipped = import_path(index, path, DATA_PATH, normalize=cfg.get('normalize', False))
+        for title, reason in skipped.items():
+            print(f'Skipped {title}: {reason}')
+        print(f'🎜 Imported {len(imported)} soundtracks ({len(skipped)} skipped).')
+    index.close()
+    sys.exit(0)
 
-@bot.event
-async def on_guild_join(new_guild: nextcord.Guild):
-    global guild
-    if new_guild.id != guild.id:
-        await new_guild.leave()
+elif '--verify' in sys.argv:
+    if not os.path.exists(DATA_PATH):
+        sys.exit(0)
+    from .internal.index import open_index
+    from .internal.integrity import verify_library
+    index = open_index(DATA_PATH)
+    broken = verify_library(index)
+    count = len(index)
+    index.close()
+    for title, problem in broken.items():
+        print(f'{title}: {problem}')
+    print(f'🎜 Verified {count} soundtracks, {len(broken)} broken.')
+    sys.exit(30 if broken else 0)
+
+elif '--analyze' in sys.argv:
+    if not os.path.exists(DATA_PATH):
+        sys.exit(0)
+    import yaml
+    from .internal.index import open_index
+    from .internal.loudness import analyze_library
+    cfg = {}
+    if os.path.exists(CONFIG_PATH):
+        with open(CONFIG_PATH, "r") as file:
+            cfg = yaml.full_load(file) or {}
+    index = open_index(DATA_PATH)
+    analyzed = analyze_library(index, normalize=cfg.get('normalize', False), force='--force' in sys.argv)
+    index.close()
+    print(f'🎜 Analyzed {analyzed} track files.')
+    sys.exit(0)
 
-@tasks.loop(seconds=5)
-async def task():
-    global voice_client
-    global block_disconnect
-    global guild
+elif '--stats' in sys.argv:
+    import yaml
+    import urllib.request
+    cfg = {}
+    if os.path.exists(CONFIG_PATH):
+        with open(CONFIG_PATH, "r") as file:
+            cfg = yaml.full_load(file) or {}
+    if not cfg.get('metrics_port'):
+        print('Metrics are disabled! Set `metrics_port` in the configuration file to enable them.')
+        sys.exit(20)
     try:
-        if len(voice_client.channel.members) <= 1 and guild.me in voice_client.channel.members and voice_client.is_connected() and not block_disconnect:
-            voice_client.stop()
-            await voice_client.disconnect()
-            logger.info('🎜 Automatically Disconnected.')
-        else:
-            block_disconnect = False
-    except ValueError:
-        pass
-    except AttributeError:
-        pass
-    except nextcord.errors.ClientException:
-        pass
-
-try:
-    UPLOADING_GUILD = int(config['guild'])
-except ValueError:
-    logger.error(f'{config["guild"]} is not a valid Guild ID! Either edit {config_path} manually, or run with `--reconfigure`!')
-    sys.exit(20)
-
-# Commands
-@bot.slash_command(description='Upload a Soundtrack', dm_permission=False, guild_ids=[UPLOADING_GUILD])
-async def upload(interaction: nextcord.Interaction, 
-    title: str = nextcord.SlashOption(description='The title for this soundtrack', min_length=3, max_length=45, required=True),
-    intro: nextcord.Attachment = nextcord.SlashOption(description='Track to play at start of soundtrack', required=True),
-    loop: nextcord.Attachment = nextcord.SlashOption(description='Track to loop once `intro` ends', required=True),
-    delay: int = nextcord.SlashOption(description='Delay between end of Intro and start of Loop (default 0)', choices=[0,1,2,3,4,5,6,7,8,9,10], default=0, required=False)):
-    """ Slash Command: Allows users to upload tracks and saves them to disk. """
-    global config
-    global role
-    if role in interaction.user.roles:
-        global requests
-        requests += 1
-        r = requests
-        logger.debug(f'{r}: Processing Soundtrack Upload Request...')
-        # Ensure Title is okay
-        if '#' in title or '>' in title or '-' in title or '.' in title:
-            await interaction.send(messages.badname, ephemeral=True)
-            return
-        # Ensure files are mp3 files
-        if intro.content_type != 'audio/mpeg' or loop.content_type != 'audio/mpeg':
-            await interaction.send(messages.notaudio, ephemeral=True)
-            logger.debug(f'{r}: Soundtrack Upload Request Cancelled. Media was not of proper type.')
-            return
-        
-        await interaction.response.defer()
-        
-        # Get Index
-        global index
-        global TRACK_PATH
-        index_path = os.path.join(TRACK_PATH, 'index.yml')
-        if index == None:
-            logger.debug(f'{r}: No Track Index at {index_path}, will save new index to it.')
-            index = {}
-        else:
-            logger.debug(f'{r}: Found existing Track Index at {index_path}')
-            
-        # Save Files
-        intro_path = os.path.join(TRACK_PATH, f'{str(uuid.uuid4())}.mp3')
-        loop_path = os.path.join(TRACK_PATH, f'{str(uuid.uuid4())}.mp3')
-        await intro.save(intro_path)
-        await loop.save(loop_path)
-        logger.debug(f'{r}: Saved Soundtrack Files successfully')
-        # Add to index
-        index[title] = {
-            'intro': intro_path,
-            'loop': loop_path,
-            'delay': delay,
-        }
-        global tracks
-        if title not in tracks:
-            tracks.append(title)
-        with open(index_path, "w+") as file:
-            index_current = yaml.full_load(file)
-            if index_current == None:
-                index_current = {}
-            index_new = index_current | index
-            yaml.dump(index_new, file)
-        refresh_index()
-        logger.debug(f'{r}: Added to index')
-        # Report Success
-        logger.success(f'Added Soundtrack: "{title}"!')
-        await interaction.send(f'**Added new Soundtrack!**\n*{title}* is now a part of the library.')
-    else:
-        await interaction.send(messages.noperm, ephemeral=True)
-
-@bot.slash_command(description='Play a soundtrack from the library', dm_permission=False)
-async def play(interaction: nextcord.Interaction, track: str = nextcord.SlashOption(description='The name of the soundtrack to play', required=True)):
-    global tracks
-    if not track in tracks:
-        await interaction.send(messages.badtrack, ephemeral=True)
-    else:
-        global voice_client
-        global guild
-        if interaction.user.voice == None:
-            await interaction.send(messages.novoice, ephemeral=True)
-            return
-        elif interaction.user.voice.channel == None or interaction.user.voice.channel.guild.id != guild.id:
-            await interaction.send(messages.novoice, ephemeral=True)
-            return
-        elif interaction.user.voice.mute or interaction.user.voice.suppress:
-            await interaction.send(messages.muted, ephemeral=True)
-            return
-        
-        if voice_client == None:
-            # Connect to Voice
-            voice_client = await interaction.user.voice.channel.connect(reconnect=True)
-        
-        global index
-        if track not in index:
-            await interaction.send(messages.badtrack.replace('.', '!'))
-            return
-        if not os.path.exists(index[track]["intro"]) or not os.path.exists(index[track]["loop"]):
-            await interaction.send(messages.trackfiles_missing)
-            return
-        
-        await interaction.send(f'**🎜 Playing Soundtrack**\n> {track}')
-
-        if voice_client.is_playing():
-            voice_client.stop()
-        if not voice_client.is_connected():
-            # Reconnect if not connected
-            voice_client = await interaction.user.voice.channel.connect(reconnect=True)
-        if voice_client.channel != interaction.user.voice.channel:
-            voice_client.move_to(interaction.user.voice.channel)
-
-        global current_loop 
-        global current_loop_delay
-        global already_delayed
-        current_loop = index[track]["loop"]
-        current_loop_delay = int(index[track]["delay"])
-        already_delayed = False
-        def play_loop(error):
-            global voice_client
-            global current_loop
-            global current_loop_delay
-            global already_delayed
-            global stop_when_looped
-            if voice_client.is_connected() and not stop_when_looped:
-                if not already_delayed:
-                    time.sleep(current_loop_delay)
-                    already_delayed = True
-                logger.info('🎜 Playing Soundtrack Loop')
-                try:
-                    voice_client.play(nextcord.FFmpegPCMAudio(current_loop), after=play_loop)
-                except nextcord.errors.ClientException:
-                    pass
-            else:
-                stop_when_looped = False
-                logger.info('🎜 Soundtrack Ended.')
-        
-        await interaction.guild.change_voice_state(channel=interaction.user.voice.channel, self_deaf=True, self_mute=False)
-
-        logger.info('🎜 Playing Soundtrack Intro')
-        global block_disconnect
-        block_disconnect = True
-        global latest_track
-        latest_track = track
-        voice_client.play(nextcord.FFmpegPCMAudio(index[track]["intro"]), after=play_loop)
-
-@bot.slash_command(description='Stop playing soundtrack', dm_permission=False)
-async def pause(interaction: nextcord.Interaction, when: str = nextcord.SlashOption(description='When to stop the track', choices=['Now', 'End of File'], default='Now', required=False)):
-    global voice_client
-    global guild
-    if voice_client == None:
-        await interaction.send(messages.notplaying, ephemeral=True)
-        return
-    elif not voice_client.is_playing():
-        await interaction.send(messages.notplaying, ephemeral=True)
-        return
-    elif interaction.user.voice == None:
-        await interaction.send(messages.novoice, ephemeral=True)
-        return
-    elif interaction.user.voice.channel == None or interaction.user.voice.channel.guild.id != guild.id:
-        await interaction.send(messages.novoice, ephemeral=True)
-        return
-    elif interaction.user.voice.mute or interaction.user.voice.suppress:
-        await interaction.send(messages.muted, ephemeral=True)
-        return
-
-    if when == 'Now':
-        voice_client.pause()
-        await interaction.send(f'**🎜 Paused**')
-    elif when == 'End of File':
-        global stop_when_looped
-        stop_when_looped = True
-        await interaction.send(f'**🎜** Pausing at *End of File*')
-
-@bot.slash_command(description='Continue playing soundtrack', dm_permission=False)
-async def resume(interaction: nextcord.Interaction):
-    global voice_client
-    if voice_client == None:
-        await interaction.send(messages.notplaying, ephemeral=True)
-        return
-    elif voice_client.is_paused():
-        voice_client.resume()
-        await interaction.send('**🎜 Resumed**')
-
-@bot.slash_command(description='Leave the Voice Channel', dm_permission=False)
-async def stop(interaction: nextcord.Interaction):
-    global voice_client
-    global latest_track
-    if voice_client == None:
-        await interaction.send(messages.notplaying, ephemeral=True)
-        return
-    elif voice_client.is_connected():
-        voice_client.stop()
-        latest_track = None
-        await voice_client.disconnect()
-        await interaction.send('**🎜 Stopped**')
-    else:
-        await interaction.send(messages.notplaying, ephemeral=True)
-
-@bot.slash_command(description='Delete a soundtrack from the library (stops playback)', dm_permission=False, guild_ids=[UPLOADING_GUILD])
-async def delete(interaction: nextcord.Interaction, track: str = nextcord.SlashOption(description='The name of the soundtrack to delete', required=True)):
-    global role
-    global voice_client
-    global latest_track
-    if role in interaction.user.roles:
-        if voice_client != None and track == latest_track:
-            voice_client.stop()
-            await voice_client.disconnect()
-        global TRACK_PATH
-        global index
-        if track in index:
-            os.remove(index[track]["intro"])
-            os.remove(index[track]["loop"])
-            index.pop(track)
-            refresh_tracks()
-            refresh_phases()
-            with open(os.path.join(TRACK_PATH, 'index.yml'), "w") as file:
-                yaml.dump(index, file)
-            await interaction.send(f'Removed soundtrack *{track}* from library.')
-        else:
-            await interaction.send(messages.badtrack, ephemeral=True)
-    else:
-        await interaction.send(messages.noperm, ephemeral=True)
-
-@bot.slash_command(description='Rename a soundtrack in the library (stops playback)', dm_permission=False, guild_ids=[UPLOADING_GUILD])
-async def rename(interaction: nextcord.Interaction,
-    old: str = nextcord.SlashOption(description='The current name of the track', required=True),
-    new: str = nextcord.SlashOption(description='The new name of the soundtrack', required=True, min_length=3, max_length=45)):
-    global role
-    global voice_client
-    if role in interaction.user.roles:
-        if voice_client != None:
-            voice_client.stop()
-            await voice_client.disconnect()
-        global TRACK_PATH
-        global tracks
-        global index
-        if old in index:
-            if '#' in new or '>' in new or '.' in new or '-' in new:
-                await interaction.send(messages.badrename, ephemeral=True)
-            else:
-                index[new] = index.pop(old)
-                refresh_tracks()
-                refresh_phases()
-                with open(os.path.join(TRACK_PATH, 'index.yml'), "w") as file:
-                    yaml.dump(index, file)
-                await interaction.send(f'Renamed *{nextcord.utils.escape_markdown(old)}* to *{nextcord.utils.escape_markdown(new)}*.')
-        else:
-            await interaction.send(messages.badtrack, ephemeral=True)
-    else:
-        await interaction.send(messages.noperm, ephemeral=True)
-
-@rename.on_autocomplete("old")
-@delete.on_autocomplete("track")
-@play.on_autocomplete("track")
-async def track_autocomplete(interaction: nextcord.Interaction, track: str):
-    global tracks
-    if not track:
-        await interaction.response.send_autocomplete(tracks)
-        return
-    near_tracks = [t for t in tracks if t.lower().startswith(track.lower())]
-    if near_tracks == []:
-        near_tracks = [t for t in tracks if track.lower() in t.lower()]
-    await interaction.response.send_autocomplete(near_tracks)
+        with urllib.request.urlopen(f'http://127.0.0.1:{cfg["metrics_port"]}/metrics', timeout=5) as response:
+            print(response.read().decode(), end='')
+    except OSError as e:
+        print(f'Could not get metrics from the bot, is it running? ({e})')
+        sys.exit(10)
+    sys.exit(0)
 
-bot.run(config["token"])
\ No newline at end of file
+from .bot import run
+run()
@@ -0,0 +1,742 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+from logging42 import logger
+
+import os
+import sys
+import time
+import asyncio
+import itertools
+import yaml
+import importlib.metadata
+from typing import Optional
+
+from xdg import BaseDirectory
+import aiohttp
+import nextcord
+from nextcord.ext import commands
+
+from .internal.util import auto_configure, get_invite_url, PACKAGE_NAME
+from .internal.storage import release
+from .internal.player import get_player, players, prefetch, GuildPlayer
+from .internal.index import open_index, entry_files
+from .internal.loudness import entry_gains, stored_loudness
+from .internal.search import TrackSearch
+from .internal.cache import packet_cache, DEFAULT_BUDGET
+from .internal.integrity import IntegrityScanner, DEFAULT_INTERVAL
+from .internal.encoding import EncoderPool
+from .internal.ingest import ingest, report, Progress
+from .internal.library import MAIN_PHASE, MAX_PHASES
+from .internal import messages
+from .internal import metrics
+
+if not '--verbose' in sys.argv:
+    logger.remove(1)
+    logger.add(sys.stdout, level="INFO")
+
+logger.debug('Starting...')
+
+# Bot Definition
+intents = nextcord.Intents.default()
+intents.guilds = True
+intents.voice_states = True
+intents.members = True
+bot = commands.Bot(intents=intents)
+
+# Load Config
+config = None
+config_dir = os.path.join(BaseDirectory.xdg_config_home, 'soundtrack')
+config_path = os.path.join(config_dir, 'config.yml')
+
+os.makedirs(f"{config_dir}", exist_ok=True)
+
+default_config = {
+    "guild": None,
+    "token": None,
+    "client_id": None,
+    "role": None,
+}
+
+if os.path.exists(config_path) and not '--reconfigure' in sys.argv:
+    with open(config_path, "r") as file:
+        config = yaml.full_load(file)
+else:
+    config = auto_configure()
+    if config == None:
+        if not '--reconfigure' in sys.argv:
+            logger.critical(f'Configuration file does not exist!\n -> You must either run interactive configuration, or copy an existing configuration file to {config_path}.')
+        sys.exit(10)
+    else:
+        with open(config_path, "w") as file:
+            yaml.dump(config, file)
+        logger.info('Configuration complete!')
+
+# Global Variables
+TRACK_PATH = os.path.join(BaseDirectory.xdg_data_home, 'soundtrack')
+
+guild = None
+role = None
+requests = 0
+
+INDEX_DELAY = 0.5 # seconds without edits before the track index is written, so a batch of edits is written at once
+
+## Refreshable global variables
+index = None
+tracks = []
+track_search = TrackSearch()
+phases = {}
+
+## Refreshing functions
+def refresh_index(also_tracks=True):
+    """ Refreshes the `index` global variable (track index) """
+    global index
+    global TRACK_PATH
+    if index != None:
+        index.close()
+    with metrics.timed('index_refresh'):
+        index = open_index(TRACK_PATH, float(config.get('index_delay', INDEX_DELAY)))
+    logger.debug(f'Loaded {len(index)} tracks from the track index')
+
+    if also_tracks:
+        refresh_tracks()
+
+def refresh_tracks():
+    """ Refreshes the `tracks` global variable (track list) """
+    global tracks
+    global index
+    global track_search
+    tracks = [name for name in index]
+    track_search.update(tracks)
+    logger.debug('Refreshed the list of tracks from the track index')
+
+def refresh_phases():
+    """ Refreshes the `phases` global variable (phase list) """
+    global tracks
+    global index
+    global phases
+    phases = {}
+    for track in tracks:
+        if 'phases' in index[track]:
+            for phase in index[track]['phases']:
+                if track in phases:
+                    phases[track].append(phase)
+                else:
+                    phases[track] = [phase]
+
+def update_track(title: str, old: str = None):
+    """ Updates `tracks`, `track_search` and `phases` for one soundtrack added, changed or removed (or renamed from `old`) """
+    global tracks
+    global index
+    global track_search
+    global phases
+    for name in (old, title):
+        if name == None:
+            continue
+        if name in index:
+            if name not in track_search:
+                tracks.append(name)
+                track_search.add(name)
+            if index[name].get('phases'):
+                phases[name] = list(index[name]['phases'])
+            else:
+                phases.pop(name, None)
+        elif name in track_search:
+            tracks.remove(name)
+            track_search.remove(name)
+            phases.pop(name, None)
+
+data_dir = os.path.join(BaseDirectory.xdg_data_home, 'soundtrack')
+os.makedirs(f"{data_dir}", exist_ok=True)
+os.makedirs(TRACK_PATH, exist_ok=True)
+
+if config.get('metrics_port'):
+    metrics.enable()
+metrics_server = None
+
+# Queued soundtracks are looked up when their turn comes, so edits in between are followed
+GuildPlayer.lookup = staticmethod(lambda title: index.get(title))
+
+# Seconds over which a new soundtrack fades in over the one playing
+GuildPlayer.crossfade = float(config.get('crossfade', 0))
+
+# Memory for the audio of recently played tracks
+packet_cache.resize(int(float(config.get('cache_size', DEFAULT_BUDGET)) * 1024 * 1024))
+
+# Frames of audio read ahead of the voice client, to absorb slow reads
+GuildPlayer.buffer = int(config.get('jitter_buffer', GuildPlayer.buffer))
+
+# Processes encoding PCM audio (crossfades, the FFmpeg fallback), started before anything else runs
+if config.get('encode_workers'):
+    GuildPlayer.encoders = EncoderPool(int(config['encode_workers']))
+
+# Initial load
+refresh_index()
+refresh_phases()
+
+# Track files are checked in the background once connected, then every `verify_interval` seconds
+integrity = IntegrityScanner(checksum=config.get('verify_checksums', False))
+integrity_task = None
+
+async def scan_periodically():
+    """ Checks every track file of the index off the event loop, now and then every `verify_interval` seconds (`0` for only once) """
+    global index
+    while True:
+        try:
+            problems = await asyncio.to_thread(integrity.scan, list(index.files()))
+            broken = [title for title, entry in index.items() if integrity.problem(entry) != None]
+            if broken:
+                logger.warning(f'{len(broken)} soundtracks have missing or damaged track files ({len(problems)} files): {", ".join(broken[:10])}')
+        except Exception:
+            # Try again next time rather than never again
+            logger.exception('Could not check the track files')
+        interval = float(config.get('verify_interval', DEFAULT_INTERVAL))
+        if interval <= 0:
+            return
+        await asyncio.sleep(interval)
+
+def flag_broken(choices: list):
+    """ Autocomplete choices with soundtracks whose files have a problem marked as such """
+    global index
+    problems = {title: integrity.problem(index[title]) for title in choices if title in index}
+    if not any(problems.values()):
+        return choices
+    return {(f'⚠ {title} ({problems[title]} files)' if problems.get(title) else title): title for title in choices}
+
+# Events
+@bot.event
+async def on_ready():
+    """ On Ready Event """
+    global config
+    msg = [
+        " ",
+        " --------------------",
+        f" 🎜 Soundtrack v{importlib.metadata.version(PACKAGE_NAME)}",
+        "    © 2023 Krafter",
+        "    MIT License",
+        " --------------------",
+        " ",
+    ]
+    for i in msg:
+        logger.info(i)
+    logger.debug(f'Logged in as {bot.user}')
+    
+    global guild
+    global role
+    global config_path
+    try:
+        guild = bot.get_guild(int(config["guild"]))
+        if guild == None:
+            raise ValueError('Guild is None')
+        logger.success(f'Connected with Guild: {guild.name} (ID: {guild.id})')
+        try:
+            role = guild.get_role(int(config["role"]))
+            if role == None:
+                raise ValueError('Role is None')
+            logger.success(f'Connected with Role: {role.name} (ID: {role.id})')
+        except ValueError:
+            logger.warning(f'Could not fetch role with ID {config["role"]}! Edit {config_path} or run with `--reconfigure`.')
+    except ValueError:
+        logger.warning(f'Could not fetch guild with ID {config["guild"]}! Edit {config_path} or run with `--reconfigure`.')
+    
+    if guild in bot.guilds:
+        logger.success(f'Connected and ready to use!')
+    else:
+        logger.success(f'Invite to your Guild: {get_invite_url(config["client_id"])}')
+
+    if 'locked' in config:
+        if not config['locked']:
+            logger.info('Soundtrack is not guild-locked!')
+    else:
+        for g in bot.guilds:
+            if g != guild:
+                await g.leave()
+
+    global integrity_task
+    if integrity_task == None:
+        integrity_task = asyncio.create_task(scan_periodically())
+
+    global metrics_server
+    if metrics.enabled and metrics_server == None:
+        metrics_server = await metrics.serve(int(config['metrics_port']))
+        logger.info(f'Serving metrics at http://127.0.0.1:{config["metrics_port"]}/metrics')
+
+@bot.event
+async def on_guild_join(new_guild: nextcord.Guild):
+    global guild
+    if 'locked' in config and not config['locked']:
+        return
+    if new_guild.id != guild.id:
+        await new_guild.leave()
+
+@bot.event
+async def on_voice_state_update(member: nextcord.Member, before: nextcord.VoiceState, after: nextcord.VoiceState):
+    """ Starts or cancels the idle timer of the guild's player when someone joins or leaves its channel """
+    player = players.get(member.guild.id)
+    if player != None:
+        player.update_idle(float(config.get('idle_timeout', 0)))
+
+try:
+    UPLOADING_GUILD = int(config['guild'])
+except ValueError:
+    logger.error(f'{config["guild"]} is not a valid Guild ID! Either edit {config_path} manually, or run with `--reconfigure`!')
+    sys.exit(20)
+
+# Commands
+@bot.slash_command(description='Upload a Soundtrack', dm_permission=False, guild_ids=[UPLOADING_GUILD])
+async def upload(interaction: nextcord.Interaction, 
+    title: str = nextcord.SlashOption(description='The title for this soundtrack', min_length=3, max_length=45, required=True),
+    intro: nextcord.Attachment = nextcord.SlashOption(description='Track to play at start of soundtrack', required=True),
+    loop: nextcord.Attachment = nextcord.SlashOption(description='Track to loop once `intro` ends', required=True),
+    delay: int = nextcord.SlashOption(description='Delay between end of Intro and start of Loop (default 0)', choices=[0,1,2,3,4,5,6,7,8,9,10], default=0, required=False)):
+    """ Slash Command: Allows users to upload tracks and saves them to disk. """
+    global config
+    global role
+    if role in interaction.user.roles:
+        global requests
+        requests += 1
+        r = requests
+        logger.debug(f'{r}: Processing Soundtrack Upload Request...')
+        # Ensure Title is okay
+        if '#' in title or '>' in title or '-' in title or '.' in title:
+            await interaction.send(messages.badname, ephemeral=True)
+            return
+        # Ensure files are mp3 files
+        if intro.content_type != 'audio/mpeg' or loop.content_type != 'audio/mpeg':
+            await interaction.send(messages.notaudio, ephemeral=True)
+            logger.debug(f'{r}: Soundtrack Upload Request Cancelled. Media was not of proper type.')
+            return
+        
+        await interaction.response.defer()
+        
+        global index
+        global TRACK_PATH
+        # Save Files: downloaded together, stored by content hash, then validated and pre-encoded to Opus off the event loop
+        progress = Progress(intro.size + loop.size)
+        reporter = asyncio.create_task(report(interaction, progress))
+        try:
+            with metrics.timed('upload'):
+                stored = await ingest([intro, loop], TRACK_PATH, normalize=config.get('normalize', False), progress=progress, measured=stored_loudness(index))
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+            # Download failed or timed out, or the files could not be written (e.g. the disk is full)
+            logger.warning(f'{r}: Could not save Soundtrack Files: {e!r}')
+            await interaction.edit_original_message(content=messages.uploadfailed)
+            return
+        finally:
+            reporter.cancel()
+        if stored == None:
+            logger.debug(f'{r}: Soundtrack Upload Request Cancelled. Media could not be read as audio.')
+            await interaction.edit_original_message(content=messages.badaudio)
+            return
+        logger.debug(f'{r}: Saved and pre-encoded Soundtrack Files successfully')
+        # Add to index
+        (intro_path, intro_info), (loop_path, loop_info) = stored
+        replaced = index.get(title)
+        index[title] = {
+            'intro': intro_path,
+            'loop': loop_path,
+            'delay': delay,
+            'loudness': {path: info['loudness'] for path, info in stored if info['loudness'] != None},
+        }
+        integrity.update(entry_files(index[title]))
+        if replaced != None:
+            release(index, replaced)
+        update_track(title)
+        logger.debug(f'{r}: Added to index')
+        # Report Success
+        logger.success(f'Added Soundtrack: "{title}"!')
+        await interaction.edit_original_message(content=f'**Added new Soundtrack!**\n*{title}* is now a part of the library.')
+    else:
+        await interaction.send(messages.noperm, ephemeral=True)
+
+@bot.slash_command(description='Play a soundtrack from the library', dm_permission=False)
+async def play(interaction: nextcord.Interaction, track: str = nextcord.SlashOption(description='The name of the soundtrack to play', required=True)):
+    requested = time.perf_counter()
+    global tracks
+    if not track in tracks:
+        await interaction.send(messages.badtrack, ephemeral=True)
+    else:
+        player = get_player(interaction.guild.id)
+        if interaction.user.voice == None:
+            await interaction.send(messages.novoice, ephemeral=True)
+            return
+        elif interaction.user.voice.channel == None or interaction.user.voice.channel.guild.id != interaction.guild.id:
+            await interaction.send(messages.novoice, ephemeral=True)
+            return
+        elif interaction.user.voice.mute or interaction.user.voice.suppress:
+            await interaction.send(messages.muted, ephemeral=True)
+            return
+        
+        global index
+        if track not in index:
+            await interaction.send(messages.badtrack.replace('.', '!'))
+            return
+        # From the last integrity scan, so playing does not wait on the disk
+        if integrity.problem(index[track]) != None:
+            await interaction.send(messages.trackfiles_missing)
+            return
+        # Load the audio while connecting, unless autocomplete already did
+        prefetch(entry_files(index[track]), entry_gains(index[track]))
+        
+        await interaction.send(f'**🎜 Playing Soundtrack**\n> {track}')
+
+        if not player.crossfade:
+            player.stop()
+        # Connect, reconnect or move to the user's channel (in standby, the voice client usually is there already)
+        await player.connect(interaction.user.voice.channel)
+        
+        await interaction.guild.change_voice_state(channel=interaction.user.voice.channel, self_deaf=True, self_mute=False)
+
+        player.play_entry(track, index[track], requested=requested)
+
+@bot.slash_command(description='Queue soundtracks to play one after another', dm_permission=False)
+async def queue(interaction: nextcord.Interaction):
+    pass
+
+@queue.subcommand(name='add', description='Add a soundtrack to the end of the queue')
+async def queue_add(interaction: nextcord.Interaction,
+    track: str = nextcord.SlashOption(description='The name of the soundtrack to queue', required=True),
+    loops: int = nextcord.SlashOption(description='Times to play its loop before moving on (default: until `/queue next`)', min_value=1, max_value=1000, required=False, default=None)):
+    global tracks
+    if not track in tracks:
+        await interaction.send(messages.badtrack, ephemeral=True)
+        return
+    player = get_player(interaction.guild.id)
+    player.enqueue(track, loops)
+    times = 'until skipped' if loops == None else f'{loops} loop{"s" if loops != 1 else ""}'
+    message = f'**🎜 Queued Soundtrack** (#{len(player.queue)})\n> {track} ({times})'
+    if not player.is_active():
+        message += '\n*Use `/queue next` to start playing.*'
+    await interaction.send(message)
+
+@queue.subcommand(name='next', description='Play the next soundtrack in the queue now')
+async def queue_next(interaction: nextcord.Interaction):
+    requested = time.perf_counter()
+    player = get_player(interaction.guild.id)
+    if not player.queue:
+        await interaction.send(messages.queueempty, ephemeral=True)
+        return
+    elif interaction.user.voice == None:
+        await interaction.send(messages.novoice, ephemeral=True)
+        return
+    elif interaction.user.voice.channel == None or interaction.user.voice.channel.guild.id != interaction.guild.id:
+        await interaction.send(messages.novoice, ephemeral=True)
+        return
+    elif interaction.user.voice.mute or interaction.user.voice.suppress:
+        await interaction.send(messages.muted, ephemeral=True)
+        return
+
+    await interaction.response.defer()
+    if not player.crossfade:
+        player.stop()
+    await player.connect(interaction.user.voice.channel)
+    await interaction.guild.change_voice_state(channel=interaction.user.voice.channel, self_deaf=True, self_mute=False)
+    track = player.next(requested)
+    if track == None:
+        await interaction.edit_original_message(content=messages.queueempty)
+    else:
+        await interaction.edit_original_message(content=f'**🎜 Playing Soundtrack**\n> {track}')
+
+@queue.subcommand(name='show', description='Show the queue')
+async def queue_show(interaction: nextcord.Interaction):
+    player = get_player(interaction.guild.id)
+    if not player.queue:
+        await interaction.send(messages.queueempty, ephemeral=True)
+        return
+    lines = [f'**🎜 Queue** ({len(player.queue)} soundtracks)']
+    for i, (track, loops) in enumerate(itertools.islice(player.queue, 10)):
+        lines.append(f'{i + 1}. {nextcord.utils.escape_markdown(track)}' + ('' if loops == None else f' ({loops}x)'))
+    if len(player.queue) > 10:
+        lines.append(f'*...and {len(player.queue) - 10} more*')
+    await interaction.send('\n'.join(lines), ephemeral=True)
+
+@queue.subcommand(name='clear', description='Remove every soundtrack from the queue')
+async def queue_clear(interaction: nextcord.Interaction):
+    player = get_player(interaction.guild.id)
+    player.clear_queue()
+    await interaction.send('**🎜 Cleared the Queue**')
+
+@bot.slash_command(description='Stop playing soundtrack', dm_permission=False)
+async def pause(interaction: nextcord.Interaction, when: str = nextcord.SlashOption(description='When to stop the track', choices=['Now', 'End of File'], default='Now', required=False)):
+    player = get_player(interaction.guild.id)
+    voice_client = player.voice_client
+    if voice_client == None:
+        await interaction.send(messages.notplaying, ephemeral=True)
+        return
+    elif not player.is_active():
+        await interaction.send(messages.notplaying, ephemeral=True)
+        return
+    elif interaction.user.voice == None:
+        await interaction.send(messages.novoice, ephemeral=True)
+        return
+    elif interaction.user.voice.channel == None or interaction.user.voice.channel.guild.id != interaction.guild.id:
+        await interaction.send(messages.novoice, ephemeral=True)
+        return
+    elif interaction.user.voice.mute or interaction.user.voice.suppress:
+        await interaction.send(messages.muted, ephemeral=True)
+        return
+
+    if when == 'Now':
+        voice_client.pause()
+        await interaction.send(f'**🎜 Paused**')
+    elif when == 'End of File':
+        player.stop_at_end()
+        await interaction.send(f'**🎜** Pausing at *End of File*')
+
+@bot.slash_command(description='Continue playing soundtrack', dm_permission=False)
+async def resume(interaction: nextcord.Interaction):
+    player = get_player(interaction.guild.id)
+    voice_client = player.voice_client
+    if voice_client == None:
+        await interaction.send(messages.notplaying, ephemeral=True)
+        return
+    elif voice_client.is_paused():
+        voice_client.resume()
+        await interaction.send('**🎜 Resumed**')
+
+@bot.slash_command(description='Leave the Voice Channel', dm_permission=False)
+async def stop(interaction: nextcord.Interaction):
+    player = get_player(interaction.guild.id)
+    voice_client = player.voice_client
+    if voice_client == None:
+        await interaction.send(messages.notplaying, ephemeral=True)
+        return
+    elif voice_client.is_connected():
+        player.stop()
+        player.track = None
+        await voice_client.disconnect()
+        await interaction.send('**🎜 Stopped**')
+    else:
+        await interaction.send(messages.notplaying, ephemeral=True)
+
+@bot.slash_command(description='Show how smoothly soundtracks are playing', dm_permission=False, guild_ids=[UPLOADING_GUILD])
+async def stats(interaction: nextcord.Interaction):
+    """ Slash Command: Playback stats of the soundtrack playing (or last played) in each server, worst first """
+    global role
+    if role in interaction.user.roles:
+        playing = [player for player in players.values() if player.stats != None]
+        if not playing:
+            await interaction.send(messages.nostats, ephemeral=True)
+            return
+        playing.sort(key=lambda player: player.stats.late + player.stats.underruns, reverse=True)
+        lines = [f'**🎜 Playback Stats** ({len(playing)} servers, {GuildPlayer.buffer} frames buffered)']
+        for player in playing[:10]:
+            server = bot.get_guild(player.guild_id)
+            name = server.name if server != None else player.guild_id
+            lines.append(f'> **{nextcord.utils.escape_markdown(str(name))}**: *{nextcord.utils.escape_markdown(str(player.track))}* for {player.stats.summary()["seconds"]:.0f}s')
+            lines.append(f'> {player.stats}')
+        cache = packet_cache.stats()
+        lines.append(f'Packet cache: {cache["hits"]} hits, {cache["misses"]} misses, {cache["bytes"] / 1024 / 1024:.1f} of {cache["budget"] / 1024 / 1024:.0f} MiB')
+        await interaction.send('\n'.join(lines), ephemeral=True)
+    else:
+        await interaction.send(messages.noperm, ephemeral=True)
+
+@bot.slash_command(description='Delete a soundtrack from the library (stops playback)', dm_permission=False, guild_ids=[UPLOADING_GUILD])
+async def delete(interaction: nextcord.Interaction, track: str = nextcord.SlashOption(description='The name of the soundtrack to delete', required=True)):
+    global role
+    if role in interaction.user.roles:
+        # The voice connection is kept, so the next /play starts right away
+        for player in list(players.values()):
+            if track == player.track:
+                player.stop()
+                player.track = None
+        global TRACK_PATH
+        global index
+        if track in index:
+            release(index, index.pop(track))
+            for player in list(players.values()):
+                player.discard(track)
+            update_track(track)
+            await interaction.send(f'Removed soundtrack *{track}* from library.')
+        else:
+            await interaction.send(messages.badtrack, ephemeral=True)
+    else:
+        await interaction.send(messages.noperm, ephemeral=True)
+
+@bot.slash_command(description='Rename a soundtrack in the library', dm_permission=False, guild_ids=[UPLOADING_GUILD])
+async def rename(interaction: nextcord.Interaction,
+    old: str = nextcord.SlashOption(description='The current name of the track', required=True),
+    new: str = nextcord.SlashOption(description='The new name of the soundtrack', required=True, min_length=3, max_length=45)):
+    global role
+    if role in interaction.user.roles:
+        global TRACK_PATH
+        global tracks
+        global index
+        if old in index:
+            if '#' in new or '>' in new or '.' in new or '-' in new:
+                await interaction.send(messages.badrename, ephemeral=True)
+            elif new in index and new != old:
+                # Replacing it would drop its files without releasing them
+                await interaction.send(messages.renametaken, ephemeral=True)
+            else:
+                index.rename(old, new)
+                # Only the title changes, so playback and queues go on under the new one
+                for player in list(players.values()):
+                    player.rename(old, new)
+                update_track(new, old)
+                await interaction.send(f'Renamed *{nextcord.utils.escape_markdown(old)}* to *{nextcord.utils.escape_markdown(new)}*.')
+        else:
+            await interaction.send(messages.badtrack, ephemeral=True)
+    else:
+        await interaction.send(messages.noperm, ephemeral=True)
+
+@bot.slash_command(description='Add a phase to a soundtrack: another loop to switch to while it plays', dm_permission=False, guild_ids=[UPLOADING_GUILD])
+async def addphase(interaction: nextcord.Interaction,
+    track: str = nextcord.SlashOption(description='The name of the soundtrack', required=True),
+    name: str = nextcord.SlashOption(description='The name of the phase (e.g. Calm, Tense or Combat)', min_length=3, max_length=45, required=True),
+    loop: nextcord.Attachment = nextcord.SlashOption(description='Track to loop during this phase', required=True)):
+    """ Slash Command: Uploads a phase loop for a soundtrack (replaces the phase of the same name). """
+    global role
+    if role in interaction.user.roles:
+        global index
+        if track not in index:
+            await interaction.send(messages.badtrack, ephemeral=True)
+            return
+        if '#' in name or '>' in name or '-' in name or '.' in name or name == MAIN_PHASE:
+            await interaction.send(messages.badphasename, ephemeral=True)
+            return
+        if name not in index[track].get('phases', {}) and len(index[track].get('phases', {})) >= MAX_PHASES:
+            await interaction.send(messages.toomanyphases, ephemeral=True)
+            return
+        if loop.content_type != 'audio/mpeg':
+            await interaction.send(messages.notaudio, ephemeral=True)
+            return
+
+        await interaction.response.defer()
+
+        progress = Progress(loop.size)
+        reporter = asyncio.create_task(report(interaction, progress))
+        try:
+            with metrics.timed('upload'):
+                stored = await ingest([loop], TRACK_PATH, normalize=config.get('normalize', False), progress=progress, measured=stored_loudness(index))
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+            logger.warning(f'Could not save Phase File: {e!r}')
+            await interaction.edit_original_message(content=messages.uploadfailed)
+            return
+        finally:
+            reporter.cancel()
+        if stored == None:
+            await interaction.edit_original_message(content=messages.badaudio)
+            return
+        if track not in index:
+            # Deleted while uploading, `--gc` removes the file
+            await interaction.edit_original_message(content=messages.badtrack)
+            return
+        (loop_path, loop_info), = stored
+        replaced = index[track]
+        entry = replaced | {'phases': replaced.get('phases', {}) | {name: loop_path}}
+        if loop_info['loudness'] != None:
+            entry['loudness'] = replaced.get('loudness', {}) | {loop_path: loop_info['loudness']}
+        index[track] = entry
+        integrity.update([loop_path])
+        release(index, replaced)
+        update_track(track)
+        logger.success(f'Added Phase "{name}" to Soundtrack "{track}"!')
+        await interaction.edit_original_message(content=f'**Added new Phase!**\n*{name}* is now a phase of *{track}*. It can be used the next time it is played.')
+    else:
+        await interaction.send(messages.noperm, ephemeral=True)
+
+@bot.slash_command(description='Remove a phase from a soundtrack', dm_permission=False, guild_ids=[UPLOADING_GUILD])
+async def deletephase(interaction: nextcord.Interaction,
+    track: str = nextcord.SlashOption(description='The name of the soundtrack', required=True),
+    name: str = nextcord.SlashOption(description='The name of the phase to remove', required=True)):
+    global role
+    if role in interaction.user.roles:
+        global index
+        if track not in index:
+            await interaction.send(messages.badtrack, ephemeral=True)
+        elif name not in index[track].get('phases', {}):
+            await interaction.send(messages.badphase, ephemeral=True)
+        else:
+            replaced = index[track]
+            remaining = {phase: path for phase, path in replaced['phases'].items() if phase != name}
+            loudness = {path: value for path, value in replaced.get('loudness', {}).items() if path != replaced['phases'][name]}
+            index[track] = replaced | {'phases': remaining, 'loudness': loudness}
+            release(index, replaced)
+            update_track(track)
+            for player in list(players.values()):
+                if player.track == track:
+                    if player.phase == name:
+                        player.switch_phase(None)
+                    player.phases = remaining
+            await interaction.send(f'Removed phase *{name}* from *{track}*.')
+    else:
+        await interaction.send(messages.noperm, ephemeral=True)
+
+@bot.slash_command(description='Switch the playing soundtrack to another phase', dm_permission=False)
+async def phase(interaction: nextcord.Interaction, name: str = nextcord.SlashOption(description='The phase to switch to', required=True)):
+    player = get_player(interaction.guild.id)
+    if player.voice_client == None or not player.is_active():
+        await interaction.send(messages.notplaying, ephemeral=True)
+        return
+    elif interaction.user.voice == None:
+        await interaction.send(messages.novoice, ephemeral=True)
+        return
+    elif interaction.user.voice.channel == None or interaction.user.voice.channel.guild.id != interaction.guild.id:
+        await interaction.send(messages.novoice, ephemeral=True)
+        return
+    elif interaction.user.voice.mute or interaction.user.voice.suppress:
+        await interaction.send(messages.muted, ephemeral=True)
+        return
+
+    if player.switch_phase(None if name == MAIN_PHASE else name):
+        await interaction.send(f'**🎜 Switched Phase**\n> {name}')
+    else:
+        await interaction.send(messages.badphase, ephemeral=True)
+
+@rename.on_autocomplete("old")
+@delete.on_autocomplete("track")
+@addphase.on_autocomplete("track")
+@deletephase.on_autocomplete("track")
+@queue_add.on_autocomplete("track")
+async def track_autocomplete(interaction: nextcord.Interaction, track: str):
+    global track_search
+    with metrics.timed('autocomplete'):
+        choices = track_search.search(track or '')
+    await interaction.response.send_autocomplete(flag_broken(choices))
+
+@play.on_autocomplete("track")
+async def play_autocomplete(interaction: nextcord.Interaction, track: str):
+    """ Like `track_autocomplete`, and starts getting ready to play once the choice is down to one soundtrack """
+    global track_search
+    with metrics.timed('autocomplete'):
+        choices = track_search.search(track or '')
+    await interaction.response.send_autocomplete(flag_broken(choices))
+
+    if len(choices) == 1 or (choices and track and choices[0].casefold() == track.casefold()):
+        global index
+        if choices[0] in index:
+            prefetch(entry_files(index[choices[0]]), entry_gains(index[choices[0]]))
+        voice = interaction.user.voice
+        if config.get('standby', False) and voice != None and voice.channel != None and voice.channel.guild.id == interaction.guild.id:
+            player = get_player(interaction.guild.id)
+            if player.voice_client == None or not player.voice_client.is_connected():
+                try:
+                    await player.connect(voice.channel)
+                except (nextcord.errors.ClientException, asyncio.TimeoutError) as e:
+                    logger.debug(f'Could not connect ahead of /play: {e}')
+
+@phase.on_autocomplete("name")
+async def playing_phase_autocomplete(interaction: nextcord.Interaction, name: str):
+    """ Phases of the soundtrack playing in the guild """
+    global phases
+    player = get_player(interaction.guild.id)
+    choices = [MAIN_PHASE, *phases.get(player.track, [])] if player.track != None else []
+    await interaction.response.send_autocomplete([c for c in choices if (name or '').casefold() in c.casefold()][:25])
+
+@deletephase.on_autocomplete("name")
+async def phase_autocomplete(interaction: nextcord.Interaction, name: str, track: str):
+    """ Phases of the soundtrack given as `track` """
+    global phases
+    choices = phases.get(track, [])
+    await interaction.response.send_autocomplete([c for c in choices if (name or '').casefold() in c.casefold()][:25])
+
+def run():
+    """ Runs the bot until it is stopped, then writes any edits still pending to the track index """
+    try:
+        bot.run(config["token"])
+    finally:
+        index.close()
+        if GuildPlayer.encoders != None:
+            GuildPlayer.encoders.close()
@@ -0,0 +1,531 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+from logging42 import logger
+
+import os
+import mmap
+import time
+import weakref
+import threading
+from array import array
+from collections import deque
+
+import numpy
+import nextcord
+from nextcord.oggparse import OggStream
+
+from .transcode import opus_path, ensure_opus
+from .cache import packet_cache
+from .loudness import volume_filter
+from . import metrics
+
+OPUS_HEADERS = (b'OpusHead', b'OpusTags')
+SILENCE = b'\xf8\xff\xfe' # One 20ms Opus frame of silence
+FRAMES_PER_SECOND = 50
+SAMPLES_PER_FRAME = 960 # per channel, 20ms at 48kHz
+CHANNELS = 2
+MMAP_SIZE = 8 * 1024 * 1024 # bytes, Opus files this big are memory mapped instead of read into memory
+JITTER_FRAMES = 3 # frames read ahead of the voice client
+FRAME_LENGTH = 1 / FRAMES_PER_SECOND # seconds
+LATE_MARGIN = 0.01 # seconds after its time a frame counts as late
+PAUSE_GAP = 1.0 # seconds; a longer wait between frames is a pause, not a stutter
+STATS_WINDOW = 3000 # frames whose production time is kept, one minute
+WARN_EVERY = 60 # seconds between warnings about stutters
+
+
+def iter_opus_packets(file):
+    """ Yields the audio packets of an Ogg Opus file, skipping its header packets """
+    for packet in OggStream(file).iter_packets():
+        if packet[:8] in OPUS_HEADERS:
+            continue
+        yield packet
+
+
+class OpusFileAudio(nextcord.AudioSource):
+    """ Streams a pre-encoded Opus file straight to the voice client, without FFmpeg or re-encoding """
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
+        self._packets = iter_opus_packets(self._file)
+
+    def read(self):
+        return next(self._packets, b'')
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        self._file.close()
+
+
+class GainAudio(nextcord.AudioSource):
+    """ Applies a gain of `gain` dB to the PCM frames of `source`, one NumPy multiply per frame """
+    def __init__(self, source: nextcord.AudioSource, gain: float):
+        self.source = source
+        self._factor = numpy.float32(10 ** (gain / 20))
+
+    def read(self):
+        data = self.source.read()
+        if not data:
+            return data
+        samples = numpy.frombuffer(data, dtype=numpy.int16) * self._factor
+        return numpy.clip(samples, -32768, 32767).astype(numpy.int16).tobytes()
+
+    def cleanup(self):
+        self.source.cleanup()
+
+
+def track_source(path: str, gain: float = 0):
+    """ Returns an audio source for the track file at `path`, preferring its pre-encoded Opus file
+
+    Pre-encoded files already have their `gain` (dB) applied, FFmpeg's output gets it frame by frame.
+    """
+    cached = opus_path(path)
+    if os.path.exists(cached):
+        return OpusFileAudio(cached)
+    if gain:
+        return GainAudio(nextcord.FFmpegPCMAudio(path), gain)
+    return nextcord.FFmpegPCMAudio(path)
+
+
+def load_opus_packets(path: str):
+    """ Reads every audio packet of an Ogg Opus file into memory """
+    with open(path, 'rb') as file:
+        return list(iter_opus_packets(file))
+
+
+class MappedOpusFile:
+    """ The audio packets of an Ogg Opus file, read in place from a memory map of the file.
+
+    Packets are zero-copy slices of the mapped pages, so every session playing the file shares the
+    kernel's page cache instead of holding its own copy, and only pages actually played are read from disk.
+    The pages are scanned once to index where each packet starts (8 bytes) and how long it is (4 bytes);
+    the rare packets spread over two pages are joined and kept as bytes.
+    Use `map_opus_file()` to share one mapping per file.
+    """
+    def __init__(self, path: str):
+        with open(path, 'rb') as file:
+            self.inode = os.fstat(file.fileno()).st_ino
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        self._offsets = array('Q')
+        self._lengths = array('I')
+        self._joined = {}
+        self._scan()
+
+    @property
+    def nbytes(self):
+        """ Memory held outside of the page cache: the packet index and joined packets """
+        return (self._offsets.itemsize + self._lengths.itemsize) * len(self._offsets) + sum(len(p) for p in self._joined.values())
+
+    def _scan(self):
+        view = self._view
+        position = 0
+        pieces = [] # (offset, length) of the parts of the packet being read
+        while position + 27 <= len(view):
+            if view[position:position + 4] != b'OggS':
+                raise ValueError(f'Not an Ogg page at byte {position}')
+            segments = view[position + 26]
+            offset = position + 27 + segments
+            for length in view[position + 27:offset]:
+                if pieces and sum(pieces[-1]) == offset:
+                    pieces[-1] = (pieces[-1][0], pieces[-1][1] + length)
+                else:
+                    pieces.append((offset, length))
+                offset += length
+                # A segment shorter than 255 bytes ends the packet
+                if length < 255:
+                    self._add(pieces)
+                    pieces = []
+            position = offset
+
+    def _add(self, pieces: list):
+        start, length = pieces[0]
+        if self._view[start:start + 8] in OPUS_HEADERS:
+            return
+        if len(pieces) > 1:
+            self._joined[len(self._offsets)] = b''.join(self._view[s:s + l] for s, l in pieces)
+        self._offsets.append(start)
+        self._lengths.append(length)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, i: int):
+        if self._joined and i in self._joined:
+            return self._joined[i]
+        start = self._offsets[i]
+        return self._view[start:start + self._lengths[i]]
+
+    def __iter__(self):
+        for i in range(len(self._offsets)):
+            yield self[i]
+
+
+_mapped = weakref.WeakValueDictionary()
+_mapped_lock = threading.Lock()
+
+
+def map_opus_file(path: str):
+    """ Returns the `MappedOpusFile` of the Opus file at `path`, shared with every other user of it """
+    with _mapped_lock:
+        mapped = _mapped.get(path)
+        # Re-encoding replaces the file, sessions still playing the old one keep their own mapping of it
+        if mapped == None or mapped.inode != os.stat(path).st_ino:
+            mapped = MappedOpusFile(path)
+            _mapped[path] = mapped
+        return mapped
+
+
+def load_track_packets(path: str):
+    """ Loads the packets of an Opus file: read into memory, or memory mapped if it is at least `MMAP_SIZE` bytes """
+    if os.path.getsize(path) >= MMAP_SIZE:
+        return map_opus_file(path)
+    return load_opus_packets(path)
+
+
+def warm(path: str, gain: float = 0):
+    """ Pre-encodes the track file at `path` (with `gain` dB) if needed and loads its packets into `packet_cache`, returns whether it could """
+    out = ensure_opus(path, audio_filter=volume_filter(gain))
+    if out == None:
+        return False
+    packet_cache.get(out, load_track_packets)
+    return True
+
+
+class SoundtrackAudio(nextcord.AudioSource):
+    """ Plays a soundtrack's intro, then `delay` seconds of silence, then its loop forever, as one gapless source.
+    
+    Both tracks are read from their pre-encoded Opus files once and held in memory (long ones are
+    memory mapped, see `MappedOpusFile`), so every loop boundary is just the next 20ms packet with no
+    FFmpeg restart in between.
+    The packets come from `packet_cache`, so recently played tracks start without reading them again.
+    `phases` maps phase names to alternative loop files, preloaded the same way: `switch()` changes
+    the loop being played at the next frame, at the same position in the loop.
+    Setting `stop_when_looped` ends the source at the end of the intro or of the current loop,
+    `loops` ends it after that many loops.
+    """
+    def __init__(self, intro: str, loop: str, delay: int = 0, phases: dict = None, loops: int = None):
+        self.stop_when_looped = False
+        self.loops = loops
+        self.phase = None
+        self._intro = packet_cache.get(opus_path(intro), load_track_packets)
+        self._loops = {None: packet_cache.get(opus_path(loop), load_track_packets)}
+        for name, path in (phases or {}).items():
+            self._loops[name] = packet_cache.get(opus_path(path), load_track_packets)
+        self._frames = self._iter_frames(delay)
+
+    def switch(self, phase: str = None):
+        """ Plays the loop of `phase` from the next frame on (None for the soundtrack's own loop) """
+        if phase not in self._loops:
+            raise KeyError(phase)
+        self.phase = phase
+
+    def _iter_frames(self, delay: int):
+        yield from self._intro
+        if self.stop_when_looped:
+            return
+        for _ in range(delay * FRAMES_PER_SECOND):
+            yield SILENCE
+        logger.info('🎜 Playing Soundtrack Loop')
+        position = 0
+        played = 0
+        while True:
+            # Looked up every frame, so a phase switch takes effect right away
+            loop = self._loops[self.phase]
+            if not loop:
+                return
+            position %= len(loop)
+            if position == 0:
+                if self.stop_when_looped or (self.loops != None and played >= self.loops):
+                    return
+                played += 1
+                metrics.count('loop_restarts')
+            yield loop[position]
+            position += 1
+
+    def read(self):
+        return next(self._frames, b'')
+
+    def is_opus(self):
+        return True
+
+
+class ChainAudio(nextcord.AudioSource):
+    """ Plays `source`, then the source given to `follow()` from the frame right after `source` ends, and so on.
+
+    `on_next(source)` is called on the audio thread each time the next source takes over.
+    """
+    def __init__(self, source: nextcord.AudioSource, on_next):
+        self.source = source
+        self._next = None
+        self._on_next = on_next
+        self._lock = threading.Lock()
+
+    def follow(self, source: nextcord.AudioSource = None):
+        """ Sets the source to play once the current one ends, replacing (and cleaning up) any previous one """
+        with self._lock:
+            previous, self._next = self._next, source
+        if previous != None:
+            previous.cleanup()
+
+    def read(self):
+        data = self.source.read()
+        if not data:
+            with self._lock:
+                if self._next == None:
+                    return data
+                self.source.cleanup()
+                self.source, self._next = self._next, None
+            self._on_next(self.source)
+            data = self.source.read()
+        return data
+
+    def is_opus(self):
+        return self.source.is_opus()
+
+    def cleanup(self):
+        self.source.cleanup()
+        self.follow(None)
+
+
+class FirstFrameAudio(nextcord.AudioSource):
+    """ Passes `source` through unchanged, calling `callback()` once its first frame has been read """
+    def __init__(self, source: nextcord.AudioSource, callback):
+        self.source = source
+        self._callback = callback
+
+    def read(self):
+        data = self.source.read()
+        if self._callback != None:
+            self._callback()
+            self._callback = None
+        return data
+
+    def is_opus(self):
+        return self.source.is_opus()
+
+    def cleanup(self):
+        self.source.cleanup()
+
+
+class CrossfadeAudio(nextcord.AudioSource):
+    """ Fades out `old` while fading in `new` over `duration` seconds, then plays `new` on its own.
+
+    During the fade both sources are decoded to PCM (Opus packets with their own decoder) and mixed
+    with equal-power gain curves, one 20ms buffer at a time, for the voice client to encode.
+    Afterwards `new`'s frames are passed through untouched and `old` is cleaned up.
+    """
+    def __init__(self, old: nextcord.AudioSource, new: nextcord.AudioSource, duration: float):
+        self.old = old
+        self.new = new
+        self._length = max(1, round(duration * FRAMES_PER_SECOND))
+        self._position = 0
+        self._opus = False
+        self._decoders = [None, None]
+        curve = numpy.linspace(0, numpy.pi / 2, self._length * SAMPLES_PER_FRAME, endpoint=False, dtype=numpy.float32)
+        self._fade_in = numpy.sin(curve)[:, None]
+        self._fade_out = numpy.cos(curve)[:, None]
+
+    def _pcm(self, i: int, source: nextcord.AudioSource):
+        """ Next frame of `source` as an array of samples, None once it has ended """
+        data = source.read()
+        if not data:
+            return None
+        if source.is_opus():
+            if self._decoders[i] == None:
+                self._decoders[i] = nextcord.opus.Decoder()
+            data = self._decoders[i].decode(bytes(data))
+        samples = numpy.frombuffer(data, dtype=numpy.int16).reshape(-1, CHANNELS)[:SAMPLES_PER_FRAME]
+        if len(samples) < SAMPLES_PER_FRAME:
+            samples = numpy.pad(samples, ((0, SAMPLES_PER_FRAME - len(samples)), (0, 0)))
+        return samples
+
+    def read(self):
+        if self._position >= self._length:
+            if self.old != None:
+                self.old.cleanup()
+                self.old = None
+            data = self.new.read()
+            self._opus = self.new.is_opus()
+            return data
+
+        new = self._pcm(1, self.new)
+        if new is None:
+            return b''
+        start = self._position * SAMPLES_PER_FRAME
+        end = start + SAMPLES_PER_FRAME
+        mixed = new * self._fade_in[start:end]
+        if self.old != None:
+            old = self._pcm(0, self.old)
+            if old is None:
+                self.old.cleanup()
+                self.old = None
+            else:
+                mixed += old * self._fade_out[start:end]
+        self._position += 1
+        self._opus = False
+        return numpy.clip(mixed, -32768, 32767).astype(numpy.int16).tobytes()
+
+    def is_opus(self):
+        return self._opus
+
+    def detach(self):
+        """ Lets go of `new` without cleaning it up, for when the crossfade never played """
+        self.new = None
+
+    def cleanup(self):
+        if self.old != None:
+            self.old.cleanup()
+            self.old = None
+        if self.new != None:
+            self.new.cleanup()
+
+
+class PlaybackStats:
+    """ How well one guild's frames kept up with its voice client, see `BufferedAudio` """
+    def __init__(self, buffer: int = JITTER_FRAMES):
+        self.buffer = buffer
+        self.started = time.time()
+        self.frames = 0
+        self.late = 0
+        self.worst_late = 0.0 # seconds
+        self.underruns = 0
+        self.waited = 0.0 # seconds spent waiting for frames in underruns
+        self.production = deque(maxlen=STATS_WINDOW) # seconds it took to read each of the last frames from the source
+        self.warned = 0.0
+
+    def summary(self):
+        """ The stats as a dict, durations in milliseconds """
+        production = sorted(self.production)
+        def percentile(q):
+            return production[min(len(production) - 1, int(len(production) * q))] * 1000 if production else 0.0
+        return {
+            'seconds': time.time() - self.started,
+            'frames': self.frames,
+            'late': self.late,
+            'worst_late_ms': self.worst_late * 1000,
+            'underruns': self.underruns,
+            'underrun_ms': self.waited * 1000,
+            'production_p50_ms': percentile(0.5),
+            'production_p99_ms': percentile(0.99),
+            'production_max_ms': production[-1] * 1000 if production else 0.0,
+            'buffer': self.buffer,
+        }
+
+    def __str__(self):
+        s = self.summary()
+        return (f'{s["frames"]} frames, {s["late"]} late (worst {s["worst_late_ms"]:.0f} ms), '
+            f'{s["underruns"]} underruns ({s["underrun_ms"]:.0f} ms), '
+            f'production p50 {s["production_p50_ms"]:.2f} ms, p99 {s["production_p99_ms"]:.2f} ms, max {s["production_max_ms"]:.2f} ms')
+
+
+class BufferedAudio(nextcord.AudioSource):
+    """ Reads `source` on its own thread, up to `stats.buffer` frames ahead of the voice client, and records into `stats`:
+
+    - how long each frame took to read from `source` (disk, FFmpeg, encoding workers...)
+    - frames the voice client took later than their 20ms slot, which it then sends late (the event loop or
+      another thread holding the GIL delayed the audio thread)
+    - underruns, when the voice client wanted a frame before `source` had produced it
+
+    The thread starts on the first `read()`, so building one does not take frames from a source that is still
+    playing. From then on only the thread touches `source`, and cleans it up once it stops reading it (at its
+    end, or after `cleanup()`).
+    """
+    def __init__(self, source: nextcord.AudioSource, stats: PlaybackStats):
+        self.source = source
+        self.stats = stats
+        self._buffer = deque()
+        self._ready = threading.Condition()
+        self._stopped = False
+        self._opus = source.is_opus()
+        self._start = None
+        self._count = 0
+        self._last = None
+        self._thread = threading.Thread(target=self._produce, name='soundtrack-buffer', daemon=True)
+        self._running = False
+
+    def _produce(self):
+        try:
+            while True:
+                with self._ready:
+                    while len(self._buffer) >= max(1, self.stats.buffer) and not self._stopped:
+                        self._ready.wait()
+                    if self._stopped:
+                        return
+                started = time.perf_counter()
+                data = self.source.read()
+                opus = self.source.is_opus()
+                elapsed = time.perf_counter() - started
+                self.stats.production.append(elapsed)
+                metrics.observe('frame_production', elapsed)
+                with self._ready:
+                    self._buffer.append((data, opus))
+                    self._ready.notify_all()
+                if not data:
+                    return
+        finally:
+            self.source.cleanup()
+
+    def read(self):
+        now = time.perf_counter()
+        # Frames are due every 20ms. The voice client waits an extra 20ms after its first frame
+        # (and after a pause), so the schedule starts from the second one
+        late = 0.0
+        if self._last == None or now - self._last > PAUSE_GAP:
+            self._start = None
+        elif self._start == None:
+            self._start, self._count = now, 0
+        self._last = now
+        if self._start != None:
+            late = now - (self._start + self._count * FRAME_LENGTH)
+            self._count += 1
+            if late < 0:
+                # Early, so the schedule really starts earlier
+                self._start += late
+                late = 0.0
+        stats = self.stats
+        if late > LATE_MARGIN:
+            stats.late += 1
+            stats.worst_late = max(stats.worst_late, late)
+            metrics.count('late_frames')
+            metrics.observe('frame_lateness', late)
+        underrun = False
+        with self._ready:
+            if not self._running and not self._stopped:
+                self._running = True
+                self._thread.start()
+            if not self._buffer and self._thread.is_alive():
+                if stats.frames > 0:
+                    underrun = True
+                    stats.underruns += 1
+                    metrics.count('underruns')
+                while not self._buffer and self._thread.is_alive():
+                    self._ready.wait(FRAME_LENGTH)
+                if stats.frames > 0:
+                    stats.waited += time.perf_counter() - now
+            if not self._buffer:
+                return b''
+            data, self._opus = self._buffer.popleft()
+            self._ready.notify_all()
+        stats.frames += 1
+        if (late > LATE_MARGIN or underrun) and time.time() - stats.warned > WARN_EVERY:
+            stats.warned = time.time()
+            logger.warning(f'🎜 Audio is stuttering: {stats}')
+        return data
+
+    def is_opus(self):
+        return self._opus
+
+    def cleanup(self):
+        """ Stops reading `source`, the thread cleans it up once it is out of `read()` """
+        with self._ready:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._ready.notify_all()
+            running = self._running
+        if not running:
+            # Never read, so the thread never took `source` over
+            self.source.cleanup()
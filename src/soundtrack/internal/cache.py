@@ -0,0 +1,106 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+from logging42 import logger
+
+import sys
+import threading
+from collections import OrderedDict
+
+from . import metrics
+
+DEFAULT_BUDGET = 128 # MiB
+POINTER_SIZE = 8 # bytes per packet in the list holding it
+
+
+def packets_size(packets):
+    """ Approximate memory held by a list of packets (or anything with `nbytes`, like a memory mapped file), in bytes """
+    nbytes = getattr(packets, 'nbytes', None)
+    if nbytes != None:
+        return nbytes
+    return sum(sys.getsizeof(packet) + POINTER_SIZE for packet in packets)
+
+
+class PacketCache:
+    """ Least-recently-used cache of the Opus packets of track files, bounded by their total size in memory.
+
+    Track files are named after their content, so a cached path never goes stale while the file exists;
+    `discard()` drops it when the file is removed. Lists handed out are shared, so they must not be modified.
+    Memory mapped files only count their packet index, their pages are the kernel's page cache.
+    """
+    def __init__(self, budget: int = DEFAULT_BUDGET * 1024 * 1024):
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, path: str):
+        return path in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, path: str, load):
+        """ Returns the packets of the file at `path`, calling `load(path)` to read them on a miss """
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry != None:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                metrics.count('packet_cache_hits')
+                return entry[0]
+            self.misses += 1
+        metrics.count('packet_cache_misses')
+        packets = load(path)
+        self.put(path, packets)
+        return packets
+
+    def put(self, path: str, packets: list):
+        """ Caches `packets` for `path`, evicting the least recently used files to stay within the budget """
+        size = packets_size(packets)
+        with self._lock:
+            self._remove(path)
+            if size > self.budget:
+                logger.debug(f'Not caching {path}, {size} bytes is more than the whole cache')
+                return
+            self._entries[path] = (packets, size)
+            self.size += size
+            while self.size > self.budget:
+                evicted, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+                metrics.count('packet_cache_evictions')
+                logger.debug(f'Evicted {evicted} from the packet cache')
+
+    def discard(self, path: str):
+        """ Drops `path` from the cache, if it is cached """
+        with self._lock:
+            self._remove(path)
+
+    def resize(self, budget: int):
+        """ Changes the budget to `budget` bytes, evicting files if the cache is now over it """
+        with self._lock:
+            self.budget = budget
+            while self.size > self.budget:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def stats(self):
+        """ Hit and miss counts, number of cached files and bytes used, as a dict """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'files': len(self._entries),
+            'bytes': self.size,
+            'budget': self.budget,
+        }
+
+    def _remove(self, path: str):
+        entry = self._entries.pop(path, None)
+        if entry != None:
+            self.size -= entry[1]
+
+
+packet_cache = PacketCache()
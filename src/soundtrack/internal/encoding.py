@@ -0,0 +1,124 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+from logging42 import logger
+
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import nextcord
+
+ENCODE_BATCH = 25 # frames encoded per trip to a worker, 0.5s of audio
+FRAME_SIZE = nextcord.opus.Encoder.FRAME_SIZE
+
+# In worker processes: the Opus encoder of each session, by key
+_encoders = {}
+
+
+def _encode(key: int, frames: list):
+    """ Encodes 20ms PCM frames to Opus packets with the encoder of session `key`, keeping its state between batches """
+    encoder = _encoders.get(key)
+    if encoder == None:
+        encoder = _encoders[key] = nextcord.opus.Encoder()
+    return [encoder.encode(frame.ljust(FRAME_SIZE, b'\0'), nextcord.opus.Encoder.SAMPLES_PER_FRAME) for frame in frames]
+
+
+def _release(key: int):
+    _encoders.pop(key, None)
+
+
+def _ready():
+    return True
+
+
+class EncoderPool:
+    """ Worker processes encoding the PCM audio of voice sessions to Opus, so encoding does not compete with the bot for the GIL.
+
+    Each session is pinned to one worker (the one with the fewest sessions) so its encoder keeps its state.
+    Workers are fresh processes that only import this module (started by a fork server, or spawned where there
+    is none, e.g. on Windows), so they share none of the bot's threads or state. They are started right away.
+    """
+    def __init__(self, workers: int):
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+        self._workers = [ProcessPoolExecutor(1, mp_context=context) for _ in range(workers)]
+        self._sessions = [0] * workers
+        self._keys = itertools.count()
+        self._lock = threading.Lock()
+        for worker in self._workers:
+            worker.submit(_ready).result()
+        logger.debug(f'Started {workers} encoding workers')
+
+    def wrap(self, source: nextcord.AudioSource):
+        """ Returns `source` as an Opus source, its PCM frames encoded by a worker """
+        with self._lock:
+            i = self._sessions.index(min(self._sessions))
+            self._sessions[i] += 1
+        return PoolEncodedAudio(source, self, i, next(self._keys))
+
+    def submit(self, i: int, key: int, frames: list):
+        return self._workers[i].submit(_encode, key, frames)
+
+    def release(self, i: int, key: int):
+        with self._lock:
+            self._sessions[i] -= 1
+        try:
+            self._workers[i].submit(_release, key)
+        except RuntimeError:
+            pass # shut down
+
+    def close(self):
+        for worker in self._workers:
+            worker.shutdown(wait=False, cancel_futures=True)
+
+
+class PoolEncodedAudio(nextcord.AudioSource):
+    """ Plays `source` as Opus: its PCM frames are encoded by `pool`, `ENCODE_BATCH` at a time, one batch ahead
+    of the one playing; Opus frames (e.g. after a crossfade) are passed through as they are read.
+    """
+    def __init__(self, source: nextcord.AudioSource, pool: EncoderPool, worker: int, key: int):
+        self.source = source
+        self._pool = pool
+        self._worker = worker
+        self._key = key
+        self._packets = self._iter_packets()
+
+    def _iter_packets(self):
+        pending = None # batch being encoded
+        data = self.source.read()
+        while data:
+            if self.source.is_opus():
+                if pending != None:
+                    yield from pending.result()
+                    pending = None
+                yield data
+                data = self.source.read()
+                continue
+            frames = []
+            while data and not self.source.is_opus() and len(frames) < ENCODE_BATCH:
+                frames.append(bytes(data))
+                data = self.source.read()
+            batch = self._pool.submit(self._worker, self._key, frames)
+            if pending != None:
+                yield from pending.result()
+            pending = batch
+        if pending != None:
+            yield from pending.result()
+
+    def read(self):
+        try:
+            return next(self._packets, b'')
+        except Exception as e:
+            logger.error(f'Could not encode audio: {e}')
+            return b''
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        self.source.cleanup()
+        if self._pool != None:
+            self._pool.release(self._worker, self._key)
+            self._pool = None
@@ -0,0 +1,225 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+from logging42 import logger
+
+import os
+import abc
+import json
+import time
+import sqlite3
+import threading
+
+import yaml
+from collections import Counter
+
+MAX_DELAY_FACTOR = 10 # a stream of edits is still written at least every `delay` * this seconds
+
+
+def entry_files(entry: dict):
+    """ Returns the paths of the track files an index entry uses """
+    return [entry['intro'], entry['loop'], *entry.get('phases', {}).values()]
+
+
+class TrackIndex(abc.ABC):
+    """ The track index: maps soundtrack titles to their entry (`intro`, `loop`, `delay`, `phases`).
+
+    The optional `phases` maps phase names to alternative loop files.
+    Reads are served from memory. Every mutation is persisted on its own by the backend (or written
+    behind, see `SqliteTrackIndex`), so an edit costs the same whatever the size of the library.
+    Entries must be replaced (`index[title] = entry`) rather than edited in place to be saved.
+    Track files can be shared between soundtracks, `refs()` counts the entries using one.
+    """
+    def __init__(self):
+        self._entries = dict(self._load())
+        self._refs = Counter()
+        for entry in self._entries.values():
+            self._refs.update(entry_files(entry))
+
+    def refs(self, path: str):
+        """ Number of index entries using the track file at `path` """
+        return self._refs[path]
+
+    def files(self):
+        """ Paths of every track file used by the index """
+        return self._refs.keys()
+
+    def _count(self, entry: dict, n: int):
+        for path in entry_files(entry):
+            self._refs[path] += n
+            if self._refs[path] <= 0:
+                del self._refs[path]
+
+    def __contains__(self, title):
+        return title in self._entries
+
+    def __getitem__(self, title: str):
+        return self._entries[title]
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, title: str, default=None):
+        return self._entries.get(title, default)
+
+    def items(self):
+        return self._entries.items()
+
+    def __setitem__(self, title: str, entry: dict):
+        self._put(title, entry)
+        if title in self._entries:
+            self._count(self._entries[title], -1)
+        self._entries[title] = entry
+        self._count(entry, 1)
+
+    def pop(self, title: str):
+        """ Removes a soundtrack from the index and returns its entry """
+        entry = self._entries[title]
+        self._remove(title)
+        del self._entries[title]
+        self._count(entry, -1)
+        return entry
+
+    def rename(self, old: str, new: str):
+        """ Moves the entry of `old` to the title `new` """
+        if old == new:
+            return
+        self._rename(old, new)
+        if new in self._entries:
+            self._count(self._entries[new], -1)
+        self._entries[new] = self._entries.pop(old)
+
+    def put_many(self, entries: dict):
+        """ Adds or replaces several soundtracks at once """
+        self._put_many(entries)
+        for title, entry in entries.items():
+            if title in self._entries:
+                self._count(self._entries[title], -1)
+            self._count(entry, 1)
+        self._entries.update(entries)
+
+    def flush(self):
+        """ Writes mutations that are written behind right away, backends writing each one as it comes have none """
+        pass
+
+    # Backend
+    @abc.abstractmethod
+    def _load(self):
+        """ Returns an iterable of `(title, entry)` pairs """
+
+    @abc.abstractmethod
+    def _put(self, title: str, entry: dict):
+        pass
+
+    @abc.abstractmethod
+    def _remove(self, title: str):
+        pass
+
+    @abc.abstractmethod
+    def _rename(self, old: str, new: str):
+        pass
+
+    def _put_many(self, entries: dict):
+        for title, entry in entries.items():
+            self._put(title, entry)
+
+
+class SqliteTrackIndex(TrackIndex):
+    """ Track index stored in an SQLite database, each write being one atomic transaction.
+
+    With a `delay` (seconds), mutations are written behind: they are collected, and written together in
+    one transaction once no other came in for `delay` seconds (only the last state of each title is written).
+    `flush()` writes them right away, `close()` flushes first.
+    """
+    def __init__(self, path: str, delay: float = 0):
+        self.path = path
+        self.delay = delay
+        self._pending = {} # title -> entry, or None to remove it
+        self._deadline = None
+        self._timer = None
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS tracks (title TEXT PRIMARY KEY, entry TEXT NOT NULL)')
+        self._db.commit()
+        super().__init__()
+
+    def _load(self):
+        for title, entry in self._db.execute('SELECT title, entry FROM tracks'):
+            yield title, json.loads(entry)
+
+    def _put(self, title: str, entry: dict):
+        self._write({title: entry})
+
+    def _remove(self, title: str):
+        self._write({title: None})
+
+    def _rename(self, old: str, new: str):
+        self._write({old: None, new: self._entries[old]})
+
+    def _put_many(self, entries: dict):
+        self._write(entries)
+
+    def _write(self, changes: dict):
+        with self._lock:
+            self._pending.update(changes)
+            if self.delay <= 0:
+                self.flush()
+                return
+            # Debounced, but not forever
+            now = time.monotonic()
+            if self._deadline == None:
+                self._deadline = now + self.delay * MAX_DELAY_FACTOR
+            if self._timer != None:
+                self._timer.cancel()
+            self._timer = threading.Timer(max(0, min(self.delay, self._deadline - now)), self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """ Writes the pending mutations to the database, in one transaction """
+        with self._lock:
+            if self._timer != None:
+                self._timer.cancel()
+                self._timer = None
+            self._deadline = None
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            try:
+                with self._db:
+                    self._db.executemany('DELETE FROM tracks WHERE title = ?', [(t,) for t, e in pending.items() if e == None])
+                    self._db.executemany('INSERT OR REPLACE INTO tracks (title, entry) VALUES (?, ?)', [(t, json.dumps(e)) for t, e in pending.items() if e != None])
+            except sqlite3.Error as e:
+                # Kept for the next flush, under anything that changed since
+                self._pending = pending | self._pending
+                logger.error(f'Could not write {len(pending)} changes to the track index: {e}')
+                raise
+            if self.delay > 0:
+                logger.debug(f'Wrote {len(pending)} changes to the track index')
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+
+def open_index(track_path: str, delay: float = 0):
+    """ Opens the track index in `track_path` (writing behind by `delay` seconds), migrating a legacy `index.yml` into it the first time """
+    db_path = os.path.join(track_path, 'index.db')
+    yml_path = os.path.join(track_path, 'index.yml')
+    index = SqliteTrackIndex(db_path, delay)
+    # `index.yml` is only moved aside once its tracks are committed, so an interrupted migration is simply redone
+    if os.path.exists(yml_path):
+        with open(yml_path, "r") as file:
+            legacy = yaml.full_load(file)
+        if legacy == None:
+            legacy = {}
+        index.put_many(legacy)
+        index.flush()
+        os.replace(yml_path, f'{yml_path}.migrated')
+        logger.info(f'🎜 Migrated {len(legacy)} tracks from {yml_path} to {db_path}')
+    return index
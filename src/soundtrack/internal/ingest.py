@@ -0,0 +1,153 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+from logging42 import logger
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import subprocess
+
+import aiohttp
+
+from .transcode import ensure_opus, remove_track_files
+from .storage import track_file
+from .loudness import measure, gain_for, volume_filter
+
+CHUNK_SIZE = 256 * 1024
+
+
+class Progress:
+    """ Progress of an upload, shown to the uploader by editing the deferred response """
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.stage = 'Downloading'
+
+    def __str__(self):
+        if self.stage == 'Downloading' and self.total:
+            return f'**🎜 {self.stage}...** {self.done * 100 // self.total}%'
+        return f'**🎜 {self.stage}...**'
+
+
+async def report(interaction, progress: Progress, every: float = 1.5):
+    """ Edits the deferred response with `progress` every `every` seconds, until cancelled """
+    shown = None
+    while True:
+        await asyncio.sleep(every)
+        if str(progress) != shown:
+            shown = str(progress)
+            try:
+                await interaction.edit_original_message(content=shown)
+            except Exception as e:
+                logger.debug(f'Could not report upload progress: {e}')
+
+
+async def download(session: aiohttp.ClientSession, url: str, path: str, progress: Progress = None):
+    """ Streams the file at `url` to `path` in chunks, without holding it in memory, returns its SHA-256 hex digest """
+    digest = hashlib.sha256()
+    async with session.get(url) as response:
+        response.raise_for_status()
+        with open(path, 'wb') as file:
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                digest.update(chunk)
+                await asyncio.to_thread(file.write, chunk)
+                if progress != None:
+                    progress.done += len(chunk)
+    return digest.hexdigest()
+
+
+def store(part: str, track_path: str, digest: str):
+    """ Moves a downloaded file to its content-addressed path, returns that path and whether it was already stored """
+    path = track_file(track_path, digest)
+    if os.path.exists(path):
+        os.remove(part)
+        return path, True
+    os.replace(part, path)
+    return path, False
+
+
+def probe(path: str):
+    """ Returns the `codec`, `sample_rate` and `duration` of the first audio stream in `path`, or None if it has none """
+    args = [
+        'ffprobe', '-v', 'error', '-select_streams', 'a:0',
+        '-show_entries', 'stream=codec_name,sample_rate:format=duration',
+        '-of', 'json', path,
+    ]
+    try:
+        result = subprocess.run(args, check=True, stdin=subprocess.DEVNULL, capture_output=True)
+        info = json.loads(result.stdout)
+        stream = info['streams'][0]
+        return {
+            'codec': stream['codec_name'],
+            'sample_rate': int(stream['sample_rate']),
+            'duration': float(info['format']['duration']),
+        }
+    except (subprocess.CalledProcessError, OSError, ValueError, KeyError, IndexError) as e:
+        logger.debug(f'Could not probe {path}: {e}')
+        return None
+
+
+def prepare(path: str, normalize: bool = False, measured: dict = None):
+    """ Validates an uploaded track file, measures its loudness and pre-encodes it (with the gain to normalize it if `normalize`)
+
+    `measured` is the loudness the index already has for the file, if it was stored before: it is not measured
+    again, and its Opus file is only encoded again if the gain to apply changed.
+    Returns its probe info, with its `loudness` (see `loudness.measure()`, plus the `gain` applied; None if it
+    could not be measured), or None if it is not usable mp3 audio.
+    """
+    info = probe(path)
+    if info == None or info['codec'] != 'mp3' or info['duration'] <= 0:
+        return None
+    loudness = measured if measured != None else measure(path)
+    gain = gain_for(loudness) if normalize else 0.0
+    # Files without a measurement were encoded without a gain
+    if ensure_opus(path, audio_filter=volume_filter(gain), replace=(measured or {}).get('gain', 0.0) != gain) == None:
+        return None
+    info['loudness'] = loudness | {'gain': gain} if loudness != None else None
+    return info
+
+
+async def ingest(attachments: list, track_path: str, normalize: bool = False, progress: Progress = None, measured: dict = None):
+    """ Downloads the attachments into `track_path` concurrently, then validates and pre-encodes them in worker threads.
+
+    Files are stored under the hash of their content, so audio that is already in the library
+    is neither stored nor encoded twice, nor measured again if `measured` (see `loudness.stored_loudness()`) has it.
+    Returns the path and probe info of each file, or None if any file is not usable audio.
+    Raises `aiohttp.ClientError` or `asyncio.TimeoutError` if a download fails, `OSError` if a file cannot be written.
+    New files are removed on failure.
+    """
+    start = time.perf_counter()
+    parts = [os.path.join(track_path, f'{uuid.uuid4()}.part') for _ in attachments]
+    try:
+        async with aiohttp.ClientSession() as session:
+            digests = await asyncio.gather(*(download(session, a.url, p, progress) for a, p in zip(attachments, parts)))
+    except BaseException:
+        for part in parts:
+            if os.path.exists(part):
+                os.remove(part)
+        raise
+    logger.debug(f'Downloaded {len(parts)} files in {time.perf_counter() - start:.2f}s')
+    stored = [store(part, track_path, digest) for part, digest in zip(parts, digests)]
+    paths = [path for path, existed in stored]
+    if progress != None:
+        progress.stage = 'Encoding'
+    infos = [None]
+    try:
+        # The same audio uploaded twice (e.g. as intro and loop) is prepared once
+        unique = list(dict.fromkeys(paths))
+        prepared = dict(zip(unique, await asyncio.gather(*(asyncio.to_thread(prepare, p, normalize, (measured or {}).get(p)) for p in unique))))
+        infos = [prepared[p] for p in paths]
+    finally:
+        if None in infos:
+            for path, existed in stored:
+                if not existed:
+                    remove_track_files(path)
+    if None in infos:
+        return None
+    logger.debug(f'Ingested {len(paths)} files in {time.perf_counter() - start:.2f}s ({sum(e for p, e in stored)} already stored)')
+    return list(zip(paths, infos))
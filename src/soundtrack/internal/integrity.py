@@ -0,0 +1,135 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+from logging42 import logger
+
+import os
+import re
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .index import entry_files
+from .ingest import CHUNK_SIZE
+from . import metrics
+
+DEFAULT_INTERVAL = 3600 # seconds between background scans
+DIGEST = re.compile(r'[0-9a-f]{64}')
+
+MISSING = 'missing'
+EMPTY = 'empty'
+CORRUPT = 'corrupt'
+
+
+def sha256(path: str):
+    """ SHA-256 of the content of the file at `path`, as hex """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        while chunk := file.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class IntegrityScanner:
+    """ Checks that the track files of the index are still there, caching what it found.
+
+    A check stats the file; with `checksum` set, files named after the SHA-256 of their content
+    (see `storage.track_file()`) are also hashed, only again once their size or modification time changes.
+    `scan()` does blocking I/O and is meant to run in a thread, `problem()` answers from the results.
+    """
+    def __init__(self, checksum: bool = False, workers: int = None):
+        self.checksum = checksum
+        self.workers = workers
+        self.scanned = None # time.time() of the end of the last full scan
+        self._results = {} # path -> problem or None
+        self._verified = {} # path -> (size, mtime) it was hashed at
+        self._fresh = None # paths checked on their own during a scan, newer than what it found
+        self._lock = threading.Lock()
+
+    def check(self, path: str, checksum: bool = False):
+        """ Problem with the track file at `path` (`MISSING`, `EMPTY` or `CORRUPT`), or None """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return MISSING
+        if stat.st_size == 0:
+            return EMPTY
+        digest = os.path.splitext(os.path.basename(path))[0]
+        if not checksum or not DIGEST.fullmatch(digest):
+            return None
+        version = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if self._verified.get(path) == version:
+                return None
+        try:
+            if sha256(path) != digest:
+                return CORRUPT
+        except OSError:
+            return MISSING
+        with self._lock:
+            self._verified[path] = version
+        return None
+
+    def scan(self, paths):
+        """ Checks every path in `paths`, replacing the previous results. Returns the problems found, by path """
+        paths = list(paths)
+        with self._lock:
+            self._fresh = set()
+        with metrics.timed('integrity_scan'):
+            with ThreadPoolExecutor(self.workers or os.cpu_count()) as pool:
+                results = dict(zip(paths, pool.map(lambda path: self.check(path, self.checksum), paths)))
+        with self._lock:
+            for path in list(self._results):
+                if path not in results and path not in self._fresh:
+                    del self._results[path]
+            # Files checked again while scanning (e.g. uploaded again) keep that newer result
+            self._results.update((path, problem) for path, problem in results.items() if path not in self._fresh)
+            self._fresh = None
+            self._verified = {path: version for path, version in self._verified.items() if path in results}
+        self.scanned = time.time()
+        problems = {path: problem for path, problem in results.items() if problem != None}
+        metrics.count('integrity_problems', len(problems))
+        logger.debug(f'Checked {len(paths)} track files, {len(problems)} with problems')
+        return problems
+
+    def _record(self, path: str, problem: str):
+        with self._lock:
+            self._results[path] = problem
+            if self._fresh != None:
+                self._fresh.add(path)
+
+    def update(self, paths):
+        """ Checks `paths` again right away (stat only), e.g. after they were uploaded """
+        for path in paths:
+            self._record(path, self.check(path))
+
+    def problem(self, entry: dict):
+        """ First problem with the track files of an index entry, or None.
+
+        Files the scanner has not seen yet are stat-ed now, then served from the results too.
+        """
+        for path in entry_files(entry):
+            with self._lock:
+                seen = path in self._results
+                problem = self._results.get(path)
+            if not seen:
+                problem = self.check(path)
+                self._record(path, problem)
+            if problem != None:
+                return problem
+        return None
+
+
+def verify_library(index, workers: int = None):
+    """ Checks (with checksums) every track file of the index, returns the problem of each broken soundtrack by title """
+    scanner = IntegrityScanner(checksum=True, workers=workers)
+    problems = scanner.scan(index.files())
+    broken = {}
+    for title, entry in index.items():
+        for path in entry_files(entry):
+            if path in problems:
+                broken[title] = f'{path} is {problems[path]}'
+                break
+    return broken
@@ -0,0 +1,209 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+from logging42 import logger
+
+import io
+import os
+import uuid
+import shutil
+import hashlib
+import tarfile
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+
+from .index import entry_files
+from .ingest import store, prepare, CHUNK_SIZE
+from .storage import release
+from .loudness import stored_loudness
+from .transcode import remove_track_files
+
+MANIFEST = 'manifest.yml'
+BAD_CHARACTERS = '#>.-'
+MAIN_PHASE = 'Main Loop' # how `/phase` calls a soundtrack's own loop
+MAX_PHASES = 24 # preloaded together, and listed with the main loop in autocomplete
+
+
+def valid_title(title: str):
+    """ Whether `title` can be used as a soundtrack title, the same rules as `/upload` """
+    return 3 <= len(title) <= 45 and not any(c in title for c in BAD_CHARACTERS)
+
+
+def valid_phase_name(name: str):
+    """ Whether `name` can be used as a phase name, the same rules as `/addphase` """
+    return valid_title(name) and name != MAIN_PHASE
+
+
+def phase_problem(entry: dict):
+    """ Why an entry to import cannot be used with `/phase`, or None """
+    invalid = [name for name in entry['phases'] if not valid_phase_name(name)]
+    if invalid:
+        return f'invalid phase name: {invalid[0]}'
+    if len(entry['phases']) > MAX_PHASES:
+        return f'more than {MAX_PHASES} phases'
+    return None
+
+
+def read_manifest(path: str):
+    """ Reads a manifest (or a legacy `index.yml`): soundtrack titles mapped to entries whose paths are relative to it """
+    with open(path, "r") as file:
+        manifest = yaml.full_load(file) or {}
+    base = os.path.dirname(os.path.abspath(path))
+    def resolve(p):
+        return os.path.join(base, p)
+    entries = {}
+    for title, entry in manifest.items():
+        entries[str(title)] = {
+            'intro': resolve(entry['intro']),
+            'loop': resolve(entry['loop']),
+            'delay': int(entry.get('delay', 0)),
+            'phases': {str(name): resolve(p) for name, p in (entry.get('phases') or {}).items()},
+        }
+    return entries
+
+
+def scan_directory(path: str):
+    """ Finds soundtracks in a directory laid out as `<title>/intro.mp3`, `<title>/loop.mp3` and optionally `<title>/phases/<name>.mp3` """
+    entries = {}
+    for title in sorted(os.listdir(path)):
+        folder = os.path.join(path, title)
+        if not os.path.isdir(folder):
+            continue
+        phases_folder = os.path.join(folder, 'phases')
+        phases = {}
+        if os.path.isdir(phases_folder):
+            for name in sorted(os.listdir(phases_folder)):
+                stem, extension = os.path.splitext(name)
+                if extension == '.mp3':
+                    phases[stem] = os.path.join(phases_folder, name)
+        entries[title] = {
+            'intro': os.path.join(folder, 'intro.mp3'),
+            'loop': os.path.join(folder, 'loop.mp3'),
+            'delay': 0,
+            'phases': phases,
+        }
+    return entries
+
+
+def import_file(source: str, track_path: str, normalize: bool = False, measured: dict = None):
+    """ Copies a track file into `track_path` under the hash of its content, then validates and pre-encodes it.
+
+    `measured` maps track files to the loudness the index has for them (see `loudness.stored_loudness()`).
+
+    Returns its stored path and probe info (see `ingest.prepare()`), or None if it is missing or not usable audio.
+    """
+    if not os.path.isfile(source):
+        return None
+    part = os.path.join(track_path, f'{uuid.uuid4()}.part')
+    digest = hashlib.sha256()
+    with open(source, 'rb') as src, open(part, 'wb') as dst:
+        while chunk := src.read(CHUNK_SIZE):
+            digest.update(chunk)
+            dst.write(chunk)
+    path, existed = store(part, track_path, digest.hexdigest())
+    info = prepare(path, normalize, (measured or {}).get(path))
+    if info == None and not existed:
+        remove_track_files(path)
+    if info == None:
+        return None
+    return path, info
+
+
+def import_library(index, entries: dict, track_path: str, normalize: bool = False, workers: int = None):
+    """ Imports soundtracks (titles mapped to entries with source paths) into `track_path` and the index.
+
+    Every distinct file is hashed, validated and pre-encoded across `workers` threads (each encode is its own
+    FFmpeg process), then all soundtracks are written to the index in one transaction.
+    Soundtracks with an invalid title, invalid phases or a file that is not usable audio are skipped.
+    Returns the imported titles and the skipped ones mapped to the reason.
+    """
+    skipped = {title: 'invalid title' for title in entries if not valid_title(title)}
+    skipped |= {title: phase_problem(entry) for title, entry in entries.items() if title not in skipped and phase_problem(entry) != None}
+    entries = {title: entry for title, entry in entries.items() if title not in skipped}
+    sources = sorted({path for entry in entries.values() for path in [entry['intro'], entry['loop'], *entry['phases'].values()]})
+    measured = stored_loudness(index)
+    with ThreadPoolExecutor(workers or os.cpu_count()) as pool:
+        imported = dict(zip(sources, pool.map(lambda source: import_file(source, track_path, normalize, measured), sources)))
+
+    new = {}
+    for title, entry in entries.items():
+        files = [entry['intro'], entry['loop'], *entry['phases'].values()]
+        missing = [source for source in files if imported[source] == None]
+        if missing:
+            skipped[title] = f'not usable audio: {missing[0]}'
+            continue
+        new[title] = {
+            'intro': imported[entry['intro']][0],
+            'loop': imported[entry['loop']][0],
+            'delay': entry['delay'],
+            'loudness': {imported[source][0]: imported[source][1]['loudness'] for source in files if imported[source][1]['loudness'] != None},
+        }
+        if entry['phases']:
+            new[title]['phases'] = {name: imported[source][0] for name, source in entry['phases'].items()}
+
+    replaced = [index[title] for title in new if title in index]
+    index.put_many(new)
+    for entry in replaced:
+        release(index, entry)
+    # Files only used by skipped soundtracks
+    for source, result in imported.items():
+        if result != None and index.refs(result[0]) == 0:
+            remove_track_files(result[0])
+    return list(new), skipped
+
+
+def import_path(index, path: str, track_path: str, normalize: bool = False, workers: int = None):
+    """ Imports a directory (see `scan_directory()`), a manifest, or an archive made by `export_library()` """
+    if os.path.isdir(path):
+        if os.path.exists(os.path.join(path, MANIFEST)):
+            return import_library(index, read_manifest(os.path.join(path, MANIFEST)), track_path, normalize, workers)
+        return import_library(index, scan_directory(path), track_path, normalize, workers)
+    if tarfile.is_tarfile(path):
+        with tempfile.TemporaryDirectory(dir=track_path) as tmp:
+            with tarfile.open(path) as archive:
+                extract(archive, tmp)
+            return import_library(index, read_manifest(os.path.join(tmp, MANIFEST)), track_path, normalize, workers)
+    return import_library(index, read_manifest(path), track_path, normalize, workers)
+
+
+def extract(archive: tarfile.TarFile, path: str):
+    """ Extracts the regular files of `archive` into `path`, refusing any that would land outside of it """
+    for member in archive.getmembers():
+        target = os.path.realpath(os.path.join(path, member.name))
+        if not member.isfile() or not target.startswith(os.path.realpath(path) + os.sep):
+            logger.warning(f'Skipped {member.name} in the archive')
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with archive.extractfile(member) as src, open(target, 'wb') as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+
+def export_library(index, path: str):
+    """ Writes every soundtrack to a tar archive at `path`: a manifest and each track file once, returns the number of soundtracks """
+    manifest = {}
+    names = {}
+    for title, entry in index.items():
+        for file in entry_files(entry):
+            names.setdefault(file, f'tracks/{os.path.basename(file)}')
+        manifest[title] = {
+            'intro': names[entry['intro']],
+            'loop': names[entry['loop']],
+            'delay': int(entry['delay']),
+        }
+        if entry.get('phases'):
+            manifest[title]['phases'] = {name: names[file] for name, file in entry['phases'].items()}
+    with tarfile.open(f'{path}.part', 'w') as archive:
+        data = yaml.dump(manifest, allow_unicode=True).encode()
+        info = tarfile.TarInfo(MANIFEST)
+        info.size = len(data)
+        archive.addfile(info, io.BytesIO(data))
+        for file, name in names.items():
+            if os.path.exists(file):
+                archive.add(file, name)
+            else:
+                logger.warning(f'🎜 {file} is missing, it is not in the archive')
+    os.replace(f'{path}.part', path)
+    return len(manifest)
@@ -0,0 +1,105 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+from logging42 import logger
+
+import os
+import json
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from .transcode import opus_path, transcode
+from .index import entry_files
+
+TARGET = -16.0 # LUFS, integrated loudness tracks are brought to
+CEILING = -1.5 # dBTP, true peak the gain may not push a track above
+MAX_GAIN = 20.0 # dB
+
+
+def measure(path: str):
+    """ Measures the EBU R128 loudness of the track file at `path`: `integrated` (LUFS) and true `peak` (dBTP), or None on failure """
+    args = [
+        'ffmpeg', '-nostdin', '-hide_banner', '-nostats',
+        '-i', path,
+        '-vn', '-af', f'loudnorm=I={TARGET}:TP={CEILING}:print_format=json',
+        '-f', 'null', '-',
+    ]
+    try:
+        result = subprocess.run(args, check=True, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        # The measurement is the last JSON object ffmpeg prints
+        info = json.loads(result.stderr[result.stderr.rindex('{'):])
+        return {
+            'integrated': float(info['input_i']),
+            'peak': float(info['input_tp']),
+        }
+    except (subprocess.CalledProcessError, OSError, ValueError, KeyError) as e:
+        logger.debug(f'Could not measure the loudness of {path}: {e}')
+        return None
+
+
+def gain_for(loudness: dict):
+    """ Gain in dB that brings a track with the measured `loudness` to `TARGET`, without its peak going over `CEILING` """
+    if loudness == None or loudness['integrated'] == float('-inf'):
+        return 0.0
+    gain = min(TARGET - loudness['integrated'], CEILING - loudness['peak'], MAX_GAIN)
+    return round(gain, 1)
+
+
+def volume_filter(gain: float):
+    """ FFmpeg filter applying `gain` dB, or None if there is nothing to apply """
+    if not gain:
+        return None
+    return f'volume={gain}dB'
+
+
+def entry_gains(entry: dict):
+    """ Gain in dB of each track file of an index entry that has one """
+    return {path: loudness['gain'] for path, loudness in entry.get('loudness', {}).items()}
+
+
+def stored_loudness(index):
+    """ Loudness the index has recorded for each track file (see `measure()`, plus the `gain` baked into its Opus file) """
+    measured = {}
+    for title, entry in index.items():
+        measured.update(entry.get('loudness', {}))
+    return measured
+
+
+def _analyze_file(path: str, measured: dict, normalize: bool, force: bool):
+    """ Measures a track file (unless it already is), and re-encodes it if the gain baked into its Opus file changes """
+    loudness = measured
+    if loudness == None or force:
+        loudness = measure(path)
+        if loudness == None:
+            return None
+    gain = gain_for(loudness) if normalize else 0.0
+    # Files without a measurement were encoded without a gain
+    if (measured or {}).get('gain', 0.0) != gain or not os.path.exists(opus_path(path)):
+        if transcode(path, audio_filter=volume_filter(gain)) == None:
+            return None
+    return loudness | {'gain': gain}
+
+
+def analyze_library(index, normalize: bool = False, workers: int = None, force: bool = False):
+    """ Measures the loudness of every track file in the index that has not been yet, across `workers` threads.
+
+    Opus files are re-encoded where the gain to apply changed (e.g. after turning `normalize` on).
+    All entries are updated in one transaction at the end. Returns the number of files analyzed.
+    """
+    measured = stored_loudness(index)
+    files = [path for path in index.files() if os.path.exists(path)]
+    # Each file is measured by its own FFmpeg process, so threads are enough to use every core
+    with ThreadPoolExecutor(workers or os.cpu_count()) as pool:
+        results = pool.map(lambda path: _analyze_file(path, measured.get(path), normalize, force), files)
+        analyzed = {path: loudness for path, loudness in zip(files, results) if loudness != None}
+
+    updated = {}
+    for title, entry in index.items():
+        loudness = entry.get('loudness', {})
+        new = {path: analyzed[path] for path in set(entry_files(entry)) if path in analyzed}
+        if any(loudness.get(path) != value for path, value in new.items()):
+            updated[title] = entry | {'loudness': loudness | new}
+    index.put_many(updated)
+    logger.info(f'🎜 Analyzed {len(analyzed)} of {len(files)} track files, updated {len(updated)} soundtracks')
+    return len(analyzed)
@@ -13,4 +13,12 @@ muted = '*You cannot use this command while Server-Muted.*'
 trackfiles_missing = '**Unexpected Problem:** The files for these tracks are missing!'
 notplaying = '*No soundtrack is currently playing.*'
 disconnected = '*Left Voice Channel.*'
-badrename = '**Could not rename.**\nThe `new` title must not include the following characters: `#`, `>`, `.`, or `-`'
\ No newline at end of file
+badrename = '**Could not rename.**\nThe `new` title must not include the following characters: `#`, `>`, `.`, or `-`'
+renametaken = '**Could not rename.**\nA soundtrack with the `new` title already exists. Delete it first.'
+badaudio = '**Could not upload.**\nOne or more files could not be read as `.mp3` audio.'
+uploadfailed = '**Could not upload.**\nThe files could not be downloaded from Discord or saved. Try again later.'
+badphase = '*No such phase found.*'
+badphasename = '**Could not add phase.**\nThe phase `name` must not be `Main Loop` or include the following characters: `#`, `>`, `.`, or `-`'
+toomanyphases = '**Could not add phase.**\nThis soundtrack already has the maximum of 24 phases.'
+queueempty = '*The queue is empty.*'
+nostats = '*Nothing has been played yet.*'
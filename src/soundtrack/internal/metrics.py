@@ -0,0 +1,106 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+import time
+from contextlib import nullcontext
+
+PREFIX = 'soundtrack'
+
+# Metrics are off unless `enable()` is called; every function below then returns right away
+enabled = False
+counters = {}
+timers = {}
+
+
+class Timer:
+    """ Durations observed for one metric, as a Prometheus histogram """
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(self.BUCKETS)
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(self.BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+
+
+class _Timing:
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start)
+
+
+_NOT_TIMING = nullcontext()
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def count(name: str, n: int = 1):
+    """ Adds `n` to the counter `name` """
+    if enabled:
+        counters[name] = counters.get(name, 0) + n
+
+
+def observe(name: str, seconds: float):
+    """ Records a duration of `seconds` for the timer `name` """
+    if enabled:
+        timer = timers.get(name)
+        if timer == None:
+            timer = timers[name] = Timer()
+        timer.observe(seconds)
+
+
+def timed(name: str):
+    """ Context manager recording how long its body takes for the timer `name` """
+    if enabled:
+        return _Timing(name)
+    return _NOT_TIMING
+
+
+def render():
+    """ Returns every metric in the Prometheus text exposition format """
+    lines = []
+    for name, value in sorted(counters.items()):
+        lines.append(f'# TYPE {PREFIX}_{name}_total counter')
+        lines.append(f'{PREFIX}_{name}_total {value}')
+    for name, timer in sorted(timers.items()):
+        metric = f'{PREFIX}_{name}_seconds'
+        lines.append(f'# TYPE {metric} histogram')
+        for bound, n in zip(Timer.BUCKETS, timer.buckets):
+            lines.append(f'{metric}_bucket{{le="{bound}"}} {n}')
+        lines.append(f'{metric}_bucket{{le="+Inf"}} {timer.count}')
+        lines.append(f'{metric}_sum {timer.sum}')
+        lines.append(f'{metric}_count {timer.count}')
+        lines.append(f'# TYPE {metric}_max gauge')
+        lines.append(f'{metric}_max {timer.max}')
+    return '\n'.join(lines) + '\n'
+
+
+async def serve(port: int, host: str = '127.0.0.1'):
+    """ Serves `render()` at http://`host`:`port`/metrics """
+    from aiohttp import web
+    async def handle(request):
+        return web.Response(text=render(), content_type='text/plain', charset='utf-8')
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
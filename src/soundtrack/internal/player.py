@@ -0,0 +1,426 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+from logging42 import logger
+
+import os
+import time
+import asyncio
+from collections import deque
+
+import nextcord
+
+from .transcode import opus_path
+from .cache import packet_cache
+from .index import entry_files
+from .loudness import entry_gains
+from .audio import track_source, warm, SoundtrackAudio, ChainAudio, FirstFrameAudio, CrossfadeAudio, BufferedAudio, PlaybackStats, JITTER_FRAMES
+from . import metrics
+
+
+players = {}
+_prefetching = set()
+_background = set()
+
+
+def get_player(guild_id: int):
+    """ Returns the player for the guild with ID `guild_id`, creating it on first use """
+    player = players.get(guild_id)
+    if player == None:
+        player = players[guild_id] = GuildPlayer(guild_id)
+    return player
+
+
+def prefetch(files: list, gains: dict = None):
+    """ Pre-encodes and loads track files into the packet cache in the background, so playing them next starts right away
+
+    `gains` maps track files to the gain (dB) to encode them with, see `loudness.entry_gains()`.
+    """
+    files = [path for path in files if opus_path(path) not in packet_cache and path not in _prefetching]
+    if not files:
+        return None
+    _prefetching.update(files)
+    task = asyncio.create_task(_prefetch(files, gains or {}))
+    # The event loop only keeps weak references to tasks
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return task
+
+
+async def _prefetch(files: list, gains: dict):
+    try:
+        with metrics.timed('prefetch'):
+            await asyncio.gather(*(asyncio.to_thread(warm, path, gains.get(path, 0)) for path in files))
+    finally:
+        _prefetching.difference_update(files)
+    logger.debug(f'Prefetched {len(files)} track files')
+
+
+class GuildPlayer:
+    """ Playback state of one guild: sequences a soundtrack's intro, delay and loop on its voice client.
+
+    Each soundtrack runs as one asyncio task, so `stop()` or a new `start()` cancels it
+    wherever it is (including during the delay), and nothing ever blocks the audio thread.
+    All guilds' players share the bot's event loop.
+    With `crossfade` (seconds), a new soundtrack fades in over the one playing instead of cutting it off.
+    With `encoders` (an `EncoderPool`), PCM audio (crossfades, the FFmpeg fallback) is encoded by worker
+    processes instead of by the voice client on the audio thread.
+    Audio is read `buffer` frames ahead of the voice client, `stats` tells how well it kept up (see `BufferedAudio`).
+
+    `queue` holds `(title, loops)` of the soundtracks to play next. The first one is prepared in the
+    background while the current soundtrack plays, and follows it on the very next frame once it has
+    played its `loops`. The queue belongs to the guild, so it outlives voice reconnects.
+    `lookup(title)` returns a soundtrack's index entry, or None if it is gone.
+    """
+    crossfade = 0
+    lookup = None
+    encoders = None
+    buffer = JITTER_FRAMES
+
+    def __init__(self, guild_id: int = None):
+        self.guild_id = guild_id
+        self.voice_client = None
+        self.track = None
+        self.source = None
+        self.phases = {}
+        self.phase = None
+        self.stop_when_looped = False
+        self.stats = None
+        self.queue = deque()
+        self._chain = None
+        self._following = None
+        self._preparing = None
+        self._task = None
+        self._started = None
+        self._fade = 0
+        self._waiter = None
+        self._connecting = None
+        self._idle_task = None
+
+    def is_active(self):
+        """ Whether a soundtrack is currently being sequenced (playing, paused or in its delay) """
+        return self._task != None and not self._task.done()
+
+    async def connect(self, channel: nextcord.VoiceChannel):
+        """ Connects the voice client to `channel`, or moves it there; concurrent calls share one connection attempt """
+        if self._connecting == None or self._connecting.done():
+            self._connecting = asyncio.create_task(self._connect(channel))
+        await asyncio.shield(self._connecting)
+
+    async def _connect(self, channel: nextcord.VoiceChannel):
+        if self.voice_client == None or not self.voice_client.is_connected():
+            self.voice_client = await channel.connect(reconnect=True)
+        elif self.voice_client.channel != channel:
+            await self.voice_client.move_to(channel)
+
+    def start(self, track: str, intro: str, loop: str, delay: int = 0, phases: dict = None, requested: float = None, loops: int = None, gains: dict = None):
+        """ Starts playing a soundtrack from its track files, replacing whatever was playing
+
+        `phases` maps phase names to alternative loop files, see `switch_phase()`.
+        `gains` maps track files to their gain in dB, see `loudness.entry_gains()`.
+        `requested` is the `time.perf_counter()` the soundtrack was asked for, time to first frame is measured from it.
+        With `loops`, the soundtrack ends after that many loops and the queue moves on.
+        """
+        self.phases = phases or {}
+        return self._start(track, self._run(intro, loop, delay, self.phases, loops, gains or {}), requested)
+
+    def play_entry(self, track: str, entry: dict, loops: int = None, requested: float = None):
+        """ Starts playing the soundtrack with the index entry `entry`, see `start()` """
+        return self.start(track, entry['intro'], entry['loop'], int(entry['delay']), entry.get('phases'), requested, loops, entry_gains(entry))
+
+    def enqueue(self, track: str, loops: int = None):
+        """ Adds a soundtrack to the end of the queue, to play `loops` times (forever if None) """
+        self.queue.append((track, loops))
+        if len(self.queue) == 1:
+            self._prepare_next()
+
+    def clear_queue(self):
+        """ Empties the queue, the current soundtrack then plays until it ends or is stopped """
+        self.queue.clear()
+        self._prepare_next()
+
+    def next(self, requested: float = None):
+        """ Starts the first soundtrack of the queue right away, returns its title (None if the queue is empty) """
+        while self.queue:
+            track, loops = self.queue.popleft()
+            entry = self.lookup(track)
+            if entry != None:
+                self.play_entry(track, entry, loops, requested)
+                return track
+        return None
+
+    def rename(self, old: str, new: str):
+        """ Follows a soundtrack being renamed from `old` to `new`, in what is playing and in the queue """
+        if self.track == old:
+            self.track = new
+        renamed = bool(self.queue) and self.queue[0][0] == old
+        self.queue = deque((new, item[1]) if item[0] == old else item for item in self.queue)
+        if renamed:
+            # What was prepared to follow still has the old title
+            self._prepare_next()
+
+    def discard(self, track: str):
+        """ Removes a deleted soundtrack from the queue, and from following the current one """
+        removed = bool(self.queue) and self.queue[0][0] == track
+        self.queue = deque(item for item in self.queue if item[0] != track)
+        if removed:
+            self._prepare_next()
+
+    def _prepare_next(self):
+        """ Prepares the first soundtrack of the queue to follow the current one, in the background """
+        if self._preparing != None:
+            self._preparing.cancel()
+            self._preparing = None
+        self._following = None
+        if self._chain == None:
+            return
+        self._chain.follow(None)
+        if self.queue:
+            self._preparing = asyncio.create_task(self._prepare(self._chain, self.queue[0]))
+
+    async def _prepare(self, chain: ChainAudio, item: tuple):
+        track, loops = item
+        entry = self.lookup(track)
+        if entry == None:
+            # Deleted since it was queued
+            self.queue.popleft()
+            self._prepare_next()
+            return
+        files = entry_files(entry)
+        with metrics.timed('prefetch'):
+            gains = entry_gains(entry)
+            ready = await asyncio.gather(*(asyncio.to_thread(warm, path, gains.get(path, 0)) for path in files))
+        if False in ready:
+            # Not pre-encoded, the FFmpeg fallback starts it once the current soundtrack ends
+            return
+        source = await asyncio.to_thread(SoundtrackAudio, entry['intro'], entry['loop'], int(entry['delay']), entry.get('phases'), loops)
+        chain.follow(source)
+        self._following = (item, entry, source)
+        logger.debug(f'Prepared {track} to play next')
+
+    def _advanced(self, source: SoundtrackAudio):
+        """ Called once a prepared soundtrack has taken over from the previous one """
+        if self._following == None or self._following[2] is not source:
+            return
+        item, entry, source = self._following
+        track = item[0]
+        self._following = None
+        self._preparing = None
+        # The same soundtrack can be queued several times, only the item that was prepared is done
+        if self.queue and self.queue[0] is item:
+            self.queue.popleft()
+        self.track = track
+        self.source = source
+        self.phases = entry.get('phases') or {}
+        self.phase = None
+        metrics.count('plays')
+        metrics.count('queue_advances')
+        logger.info(f'🎜 Playing next Soundtrack: {track}')
+        self._prepare_next()
+
+    def start_sequence(self, track: str, intro, loop, delay: int = 0):
+        """ Like `start()`, but plays sources made by the `intro` and `loop` callables (see `play_sequence()`) """
+        return self._start(track, self.play_sequence(intro, loop, delay))
+
+    def _start(self, track: str, coro, requested: float = None):
+        if self.crossfade > 0 and self.voice_client != None and self.voice_client.is_playing():
+            # Keep the current soundtrack playing until the new one is ready to fade in
+            self._fade = self.crossfade
+            if self._task != None:
+                self._task.cancel()
+                self._task = None
+        else:
+            self._fade = 0
+            self.stop()
+        self._unchain()
+        self.track = track
+        self.source = None
+        self.phase = None
+        self.stop_when_looped = False
+        self.stats = PlaybackStats(self.buffer)
+        self._started = requested or time.perf_counter()
+        metrics.count('plays')
+        self._task = asyncio.create_task(coro)
+        return self._task
+
+    def stop(self):
+        """ Cancels the current soundtrack and stops the voice client """
+        if self._task != None:
+            self._task.cancel()
+            self._task = None
+        self._unchain()
+        if self.voice_client != None:
+            self.voice_client.stop()
+
+    def _unchain(self):
+        """ Stops the queue from following the current soundtrack """
+        if self._chain != None:
+            self._chain.follow(None)
+            self._chain = None
+        if self._preparing != None:
+            self._preparing.cancel()
+            self._preparing = None
+        self._following = None
+
+    def update_idle(self, timeout: float):
+        """ Starts the idle timer if nobody is listening in the voice channel anymore, or cancels it if someone is.
+
+        When the timer runs out after `timeout` seconds, playback stops and the voice channel is left.
+        """
+        voice_client = self.voice_client
+        if voice_client == None or not voice_client.is_connected() or voice_client.channel == None:
+            self.cancel_idle()
+        elif any(not member.bot for member in voice_client.channel.members):
+            self.cancel_idle()
+        elif self._idle_task == None or self._idle_task.done():
+            self._idle_task = asyncio.create_task(self._disconnect_after(timeout))
+
+    def cancel_idle(self):
+        """ Cancels the idle timer """
+        if self._idle_task != None:
+            self._idle_task.cancel()
+            self._idle_task = None
+
+    async def _disconnect_after(self, timeout: float):
+        await asyncio.sleep(timeout)
+        self._idle_task = None
+        self.stop()
+        await self.voice_client.disconnect()
+        logger.info(f'🎜 Automatically Disconnected from {self.voice_client.channel}.')
+
+    def stop_at_end(self):
+        """ Ends the current soundtrack once the current file is done """
+        self.stop_when_looped = True
+        self._unchain()
+        if isinstance(self.source, SoundtrackAudio):
+            self.source.stop_when_looped = True
+
+    def switch_phase(self, phase: str = None):
+        """ Switches the current soundtrack to the loop of `phase` (None for its own loop), returns whether it has that phase
+
+        Pre-encoded soundtracks switch at the next frame, the FFmpeg fallback at the end of the current loop.
+        """
+        if phase != None and phase not in self.phases:
+            return False
+        self.phase = phase
+        if isinstance(self.source, SoundtrackAudio):
+            self.source.switch(phase)
+        return True
+
+    async def _run(self, intro: str, loop: str, delay: int, phases: dict, loops: int, gains: dict):
+        files = [intro, loop, *phases.values()]
+        # Recently played tracks are still in memory, so they start without touching the disk
+        cached = all(opus_path(path) in packet_cache for path in files)
+        encoded = cached or all(os.path.exists(opus_path(path)) for path in files)
+        if not encoded:
+            # Tracks uploaded before pre-encoding existed are encoded in the background, FFmpeg plays them this time
+            prefetch(files, gains)
+        logger.info('🎜 Playing Soundtrack Intro')
+        try:
+            if encoded:
+                if cached:
+                    source = SoundtrackAudio(intro, loop, delay, phases, loops)
+                else:
+                    source = await asyncio.to_thread(SoundtrackAudio, intro, loop, delay, phases, loops)
+                if self.stop_when_looped:
+                    source.stop_when_looped = True
+                source.switch(self.phase)
+                self.source = source
+                # Queued soundtracks take over from the audio thread, without a gap
+                event_loop = asyncio.get_running_loop()
+                self._chain = ChainAudio(source, lambda next_source: event_loop.call_soon_threadsafe(self._advanced, next_source))
+                self._prepare_next()
+                await self.play_source(self._chain)
+            else:
+                # FFmpeg fallback until the tracks are pre-encoded (or if they cannot be)
+                def next_loop():
+                    path = phases.get(self.phase, loop)
+                    return track_source(path, gains.get(path, 0))
+                await self.play_sequence(lambda: track_source(intro, gains.get(intro, 0)), next_loop, delay, loops)
+        except nextcord.errors.ClientException as e:
+            metrics.count('play_client_errors')
+            logger.debug(f'Could not play soundtrack: {e}')
+        else:
+            self._unchain()
+            if not self.stop_when_looped and self.queue:
+                # The next soundtrack was not ready in time, or cannot be chained
+                self._task = None
+                self.next()
+        if self.stats != None and (self.stats.late or self.stats.underruns):
+            logger.info(f'🎜 Playback: {self.stats}')
+        else:
+            logger.debug(f'🎜 Playback: {self.stats}')
+        logger.info('🎜 Soundtrack Ended.')
+
+    async def play_sequence(self, intro, loop, delay: int = 0, loops: int = None):
+        """ Plays the source made by `intro()`, waits `delay` seconds, then plays sources made by `loop()` until stopped (or `loops` times) """
+        self.source = intro()
+        await self.play_source(self.source)
+        if self.stop_when_looped:
+            return
+        await asyncio.sleep(delay)
+        played = 0
+        while not self.stop_when_looped and self.voice_client.is_connected() and (loops == None or played < loops):
+            logger.info('🎜 Playing Soundtrack Loop')
+            metrics.count('loop_restarts')
+            played += 1
+            self.source = loop()
+            await self.play_source(self.source)
+
+    async def play_source(self, source: nextcord.AudioSource):
+        """ Plays `source` on the voice client and waits until it finishes """
+        event_loop = asyncio.get_running_loop()
+        if self.encoders != None and not source.is_opus():
+            source = self.encoders.wrap(source)
+        if self._started != None:
+            # Time from `start()` to the first frame of audio, including any encoding and loading
+            started, self._started = self._started, None
+            track = self.track
+            source = FirstFrameAudio(source, lambda: self._first_frame(track, time.perf_counter() - started))
+        fade, self._fade = self._fade, 0
+        if fade > 0:
+            done = asyncio.Event()
+            if self._crossfade(source, fade, done):
+                await done.wait()
+                return
+        done = asyncio.Event()
+        self.voice_client.stop()
+        # `after` finishes whichever source `waiter` holds, so a crossfade can take over the voice client's player
+        waiter = self._waiter = [done]
+        self.voice_client.play(BufferedAudio(source, self._stats()), after=lambda error: event_loop.call_soon_threadsafe(waiter[0].set))
+        await done.wait()
+
+    def _stats(self):
+        if self.stats == None:
+            self.stats = PlaybackStats(self.buffer)
+        return self.stats
+
+    def _first_frame(self, track: str, seconds: float):
+        metrics.observe('play_first_frame', seconds)
+        logger.info(f'🎜 First frame of {track} after {seconds * 1000:.0f} ms')
+
+    def _crossfade(self, source: nextcord.AudioSource, fade: float, done: asyncio.Event):
+        """ Swaps the voice client over to a crossfade from what it is playing into `source`, returns whether it did """
+        playing = self.voice_client.source
+        if playing == None or self._waiter == None or not self.voice_client.is_playing():
+            return False
+        try:
+            if self.encoders == None and not self.voice_client.encoder:
+                # The mixed frames are PCM, which the voice client encodes itself
+                self.voice_client.encoder = nextcord.opus.Encoder()
+            crossfade = CrossfadeAudio(playing, source, fade)
+        except nextcord.opus.OpusNotLoaded:
+            return False
+        mixed = crossfade
+        if self.encoders != None:
+            mixed = self.encoders.wrap(mixed)
+        mixed = BufferedAudio(mixed, self._stats())
+        self._waiter[0] = done
+        self.voice_client.source = mixed
+        if self.voice_client.is_playing():
+            return True
+        # The old soundtrack ended right before the swap, so nothing read `mixed`: `source` is played on its own instead
+        crossfade.detach()
+        mixed.cleanup()
+        return False
@@ -0,0 +1,118 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+import heapq
+from bisect import bisect_left, insort
+
+MAX_CHOICES = 25 # Discord's limit for autocomplete choices
+DENSE_GRAM = 1024 # Past this many titles sharing each trigram, scanning in order beats intersecting
+
+
+def _grams(key: str):
+    return {key[i:i + 3] for i in range(len(key) - 2)}
+
+
+class TrackSearch:
+    """ Search index over track titles for autocomplete.
+
+    Matches are ranked: titles starting with the query, then titles with a word starting
+    with it, then titles containing it anywhere. Titles are casefolded once when added, kept in
+    sorted arrays for prefix lookups and in a trigram index for substring lookups.
+    """
+    def __init__(self, titles=()):
+        self._folded = {}
+        self._keys = [] # sorted (casefolded title, title)
+        self._words = [] # sorted (casefolded word, title)
+        self._grams = {} # trigram -> titles containing it
+        self.update(titles)
+
+    def __len__(self):
+        return len(self._folded)
+
+    def __contains__(self, title: str):
+        return title in self._folded
+
+    def add(self, title: str):
+        if title in self._folded:
+            return
+        key = self._index(title)
+        insort(self._keys, (key, title))
+        for word in set(key.split()[1:]):
+            insort(self._words, (word, title))
+
+    def _index(self, title: str):
+        key = title.casefold()
+        self._folded[title] = key
+        for gram in _grams(key):
+            self._grams.setdefault(gram, set()).add(title)
+        return key
+
+    def remove(self, title: str):
+        key = self._folded.pop(title, None)
+        if key == None:
+            return
+        self._keys.pop(bisect_left(self._keys, (key, title)))
+        for word in set(key.split()[1:]):
+            self._words.pop(bisect_left(self._words, (word, title)))
+        for gram in _grams(key):
+            titles = self._grams[gram]
+            titles.discard(title)
+            if not titles:
+                del self._grams[gram]
+
+    def update(self, titles):
+        """ Brings the index in line with `titles`, only adding and removing what changed """
+        titles = set(titles)
+        for title in self._folded.keys() - titles:
+            self.remove(title)
+        added = titles - self._folded.keys()
+        if len(added) < 64:
+            for title in added:
+                self.add(title)
+            return
+        # Bulk load: append everything, then sort once
+        for title in added:
+            key = self._index(title)
+            self._keys.append((key, title))
+            self._words += [(word, title) for word in set(key.split()[1:])]
+        self._keys.sort()
+        self._words.sort()
+
+    def search(self, query: str, limit: int = MAX_CHOICES):
+        """ Returns up to `limit` titles matching `query`, best matches first """
+        query = query.casefold().strip()
+        if not query:
+            return [title for key, title in self._keys[:limit]]
+        results = []
+        seen = set()
+
+        for sorted_keys in (self._keys, self._words):
+            i = bisect_left(sorted_keys, (query,))
+            while i < len(sorted_keys) and len(results) < limit and sorted_keys[i][0].startswith(query):
+                title = sorted_keys[i][1]
+                if title not in seen:
+                    seen.add(title)
+                    results.append(title)
+                i += 1
+            if len(results) >= limit:
+                return results
+
+        grams = sorted(_grams(query), key=lambda gram: len(self._grams.get(gram, ())))
+        if not grams or len(self._grams.get(grams[0], ())) > DENSE_GRAM:
+            # Too short for trigrams, or so common that matches are dense: scan in order until the list is full
+            for key, title in self._keys:
+                if query in key and title not in seen:
+                    results.append(title)
+                    if len(results) >= limit:
+                        break
+            return results
+
+        candidates = set(self._grams.get(grams[0], ()))
+        for gram in grams[1:]:
+            if not candidates:
+                break
+            candidates &= self._grams.get(gram, set())
+        candidates = [title for title in candidates if title not in seen and query in self._folded[title]]
+        results += heapq.nsmallest(limit - len(results), candidates, key=self._folded.get)
+        return results
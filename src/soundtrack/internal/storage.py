@@ -0,0 +1,50 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+from logging42 import logger
+
+import os
+import time
+
+from .index import entry_files
+from .transcode import remove_track_files
+
+GC_GRACE = 3600 # seconds; younger files may belong to an upload that is not indexed yet
+TRACK_EXTENSIONS = ('.mp3', '.opus', '.part')
+
+
+def track_file(track_path: str, digest: str):
+    """ Returns the path a track file with the SHA-256 `digest` is stored at """
+    return os.path.join(track_path, f'{digest}.mp3')
+
+
+def release(index, entry: dict):
+    """ Removes the track files of a removed or replaced index entry that no other entry uses """
+    unused = [path for path in entry_files(entry) if index.refs(path) == 0]
+    if not unused:
+        return
+    # Written behind, the index on disk could still point to the files after a crash
+    index.flush()
+    for path in unused:
+        remove_track_files(path)
+        logger.debug(f'Removed unused track file {path}')
+
+
+def collect_garbage(index, track_path: str, grace: float = GC_GRACE):
+    """ Removes files in `track_path` that no index entry uses, returns their paths """
+    used = {os.path.splitext(path)[0] for path in index.files()}
+    removed = []
+    now = time.time()
+    for name in os.listdir(track_path):
+        path = os.path.join(track_path, name)
+        stem, extension = os.path.splitext(path)
+        if extension == '.part':
+            stem = os.path.splitext(stem)[0]
+        if extension not in TRACK_EXTENSIONS or stem in used:
+            continue
+        if now - os.path.getmtime(path) < grace:
+            continue
+        os.remove(path)
+        removed.append(path)
+    return removed
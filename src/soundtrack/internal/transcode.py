@@ -0,0 +1,69 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+from logging42 import logger
+
+import os
+import subprocess
+import threading
+
+from .cache import packet_cache
+
+OPUS_BITRATE = 128 # kbps, same as nextcord's FFmpegOpusAudio default
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def opus_path(path: str):
+    """ Returns the path of the pre-encoded Opus file kept alongside the track file at `path` """
+    return os.path.splitext(path)[0] + '.opus'
+
+
+def transcode(path: str, bitrate: int = OPUS_BITRATE, audio_filter: str = None):
+    """ Encodes the track file at `path` once into 20ms Opus packets in an Ogg file, returns its path (or None on failure)
+    
+    `audio_filter` is an optional FFmpeg filter graph (`-af`) applied while encoding.
+    """
+    out = opus_path(path)
+    part = f'{out}.part'
+    args = [
+        'ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-y',
+        '-i', path,
+        '-vn', '-map_metadata', '-1',
+        *(['-af', audio_filter] if audio_filter else []),
+        '-c:a', 'libopus', '-b:a', f'{bitrate}k', '-ar', '48000', '-ac', '2',
+        '-frame_duration', '20', '-application', 'audio',
+        '-f', 'ogg', part,
+    ]
+    try:
+        subprocess.run(args, check=True, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except (subprocess.CalledProcessError, OSError) as e:
+        logger.warning(f'🎜 Could not pre-encode {path}: {getattr(e, "stderr", None) or e}')
+        if os.path.exists(part):
+            os.remove(part)
+        return None
+    os.replace(part, out)
+    packet_cache.discard(out)
+    logger.debug(f'Pre-encoded {path} to {out}')
+    return out
+
+
+def ensure_opus(path: str, audio_filter: str = None, replace: bool = False):
+    """ Returns the pre-encoded Opus file for `path`, transcoding it first if it does not exist yet (or if `replace`) """
+    with _locks_lock:
+        lock = _locks.setdefault(path, threading.Lock())
+    with lock:
+        out = opus_path(path)
+        if os.path.exists(out) and not replace:
+            return out
+        return transcode(path, audio_filter=audio_filter)
+
+
+def remove_track_files(path: str):
+    """ Removes the track file at `path` along with its pre-encoded Opus file """
+    packet_cache.discard(opus_path(path))
+    for p in (path, opus_path(path)):
+        if os.path.exists(p):
+            os.remove(p)
@@ -2,8 +2,14 @@
 # Soundtrack 
 # Copyright (c) 2023 Krafter Developer
 # 
-from logging42 import logger
-from requests.models import PreparedRequest
+import os
+from urllib.parse import urlencode
+
+from xdg import BaseDirectory
+
+PACKAGE_NAME = 'soundtrack'
+CONFIG_PATH = os.path.join(BaseDirectory.xdg_config_home, PACKAGE_NAME, 'config.yml')
+DATA_PATH = os.path.join(BaseDirectory.xdg_data_home, PACKAGE_NAME)
 
 
 def get_invite_url(client_id: str):
@@ -14,13 +20,12 @@ def get_invite_url(client_id: str):
         "permissions": "3147776",
         "scope": "bot",
     }
-    r = PreparedRequest()
-    r.prepare_url(base_url, params)
-    return r.url
+    return f'{base_url}?{urlencode(params)}'
 
 
 def auto_configure():
     """ Interactive Configuration """
+    from logging42 import logger
     logger.info('Running interactive configuration...')
     if input('Continue? [Y/n] ').strip(' \n').lower() != 'n':
         while True:
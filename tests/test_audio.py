@@ -0,0 +1,84 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+""" Tests for the audio sources """
+import time
+import threading
+
+import nextcord
+
+from soundtrack.internal.audio import BufferedAudio, PlaybackStats
+
+
+class SlowAudio(nextcord.AudioSource):
+    """ Opus source of `frames` frames taking `delay` seconds each, which fails if cleaned up while reading """
+    def __init__(self, frames: int, delay: float = 0):
+        self.frames = frames
+        self.delay = delay
+        self.reading = False
+        self.cleaned = 0
+        self.overlapped = False
+        self.started = threading.Event()
+
+    def read(self):
+        self.reading = True
+        self.started.set()
+        time.sleep(self.delay)
+        self.reading = False
+        if self.frames <= 0:
+            return b''
+        self.frames -= 1
+        return b'\xf8\xff\xfe'
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        self.overlapped = self.overlapped or self.reading
+        self.cleaned += 1
+
+
+def test_starts_reading_on_first_read():
+    source = SlowAudio(100)
+    audio = BufferedAudio(source, PlaybackStats())
+    time.sleep(0.05)
+    assert not source.started.is_set()
+    assert audio.read()
+    audio.cleanup()
+
+
+def test_cleanup_before_first_read():
+    source = SlowAudio(100)
+    audio = BufferedAudio(source, PlaybackStats())
+    audio.cleanup()
+    audio.cleanup()
+    assert source.cleaned == 1
+    assert not source.started.is_set()
+    assert audio.read() == b''
+
+
+def test_cleanup_waits_for_read():
+    source = SlowAudio(100, delay=0.1)
+    audio = BufferedAudio(source, PlaybackStats())
+    audio.read()
+    # The thread is now reading the next frame
+    time.sleep(0.05)
+    assert source.reading
+    audio.cleanup()
+    assert source.cleaned == 0
+    audio._thread.join(1)
+    assert source.cleaned == 1
+    assert not source.overlapped
+
+
+def test_source_cleaned_up_at_end():
+    source = SlowAudio(3)
+    audio = BufferedAudio(source, PlaybackStats())
+    frames = []
+    while data := audio.read():
+        frames.append(data)
+    assert len(frames) == 3
+    audio._thread.join(1)
+    audio.cleanup()
+    assert source.cleaned == 1
@@ -0,0 +1,148 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+""" Tests for leaving voice channels nobody is listening in """
+import os
+import sys
+import json
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from xdg import BaseDirectory
+
+import soundtrack
+from soundtrack.internal.player import GuildPlayer, players
+
+TIMEOUT = 0.05
+
+
+class FakeVoiceClient:
+    """ Stands in for `nextcord.VoiceClient` connected to `channel` """
+    def __init__(self, channel, connected: bool = True):
+        self.channel = channel
+        self.connected = connected
+        self.disconnected = False
+
+    def is_connected(self):
+        return self.connected
+
+    def stop(self):
+        pass
+
+    async def disconnect(self, *, force: bool = False):
+        self.connected = False
+        self.disconnected = True
+
+
+def member(bot: bool = False):
+    return SimpleNamespace(bot=bot, guild=SimpleNamespace(id=1))
+
+
+def connected_player(*members):
+    player = GuildPlayer(1)
+    player.voice_client = FakeVoiceClient(SimpleNamespace(name='General', members=list(members)))
+    return player
+
+
+def test_timer_starts_when_last_listener_leaves():
+    async def run():
+        listener = member()
+        player = connected_player(member(bot=True), listener)
+        player.update_idle(TIMEOUT)
+        assert player._idle_task == None
+        player.voice_client.channel.members.remove(listener)
+        player.update_idle(TIMEOUT)
+        assert player._idle_task != None
+        player.cancel_idle()
+    asyncio.run(run())
+
+
+def test_timer_cancelled_on_rejoin():
+    async def run():
+        player = connected_player(member(bot=True))
+        player.update_idle(TIMEOUT)
+        task = player._idle_task
+        player.voice_client.channel.members.append(member())
+        player.update_idle(TIMEOUT)
+        assert player._idle_task == None
+        await asyncio.sleep(TIMEOUT * 2)
+        assert task.cancelled()
+        assert not player.voice_client.disconnected
+    asyncio.run(run())
+
+
+def test_disconnects_after_timeout():
+    async def run():
+        player = connected_player(member(bot=True))
+        player.update_idle(TIMEOUT)
+        await asyncio.sleep(TIMEOUT / 2)
+        assert not player.voice_client.disconnected
+        await asyncio.sleep(TIMEOUT * 2)
+        assert player.voice_client.disconnected
+        assert player._idle_task == None
+    asyncio.run(run())
+
+
+def test_no_timer_while_not_connected():
+    async def run():
+        player = GuildPlayer(1)
+        player.update_idle(TIMEOUT)
+        assert player._idle_task == None
+        player.voice_client = FakeVoiceClient(SimpleNamespace(name='General', members=[]), connected=False)
+        player.update_idle(TIMEOUT)
+        assert player._idle_task == None
+    asyncio.run(run())
+
+
+@pytest.fixture(scope='module')
+def bot(tmp_path_factory):
+    """ The bot module, imported with a configuration in a temporary directory, and unloaded afterwards """
+    tmp = tmp_path_factory.mktemp('bot')
+    os.makedirs(tmp / 'config' / 'soundtrack')
+    with open(tmp / 'config' / 'soundtrack' / 'config.yml', 'w') as file:
+        json.dump({'guild': '1', 'token': 'test', 'client_id': '1', 'role': '1', 'locked': False}, file)
+    loop = asyncio.new_event_loop()
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv('XDG_CONFIG_HOME', str(tmp / 'config'))
+        monkeypatch.setenv('XDG_DATA_HOME', str(tmp / 'data'))
+        # Read from the environment when `xdg` was first imported
+        monkeypatch.setattr(BaseDirectory, 'xdg_config_home', str(tmp / 'config'))
+        monkeypatch.setattr(BaseDirectory, 'xdg_data_home', str(tmp / 'data'))
+        # Set up by the bot while importing
+        for name in ('lookup', 'crossfade', 'buffer', 'encoders'):
+            monkeypatch.setattr(GuildPlayer, name, GuildPlayer.__dict__[name])
+        monkeypatch.delitem(sys.modules, 'soundtrack.bot', raising=False)
+        # The client takes the current event loop when it is created
+        asyncio.set_event_loop(loop)
+        try:
+            from soundtrack import bot
+            yield bot
+            bot.index.close()
+        finally:
+            sys.modules.pop('soundtrack.bot', None)
+            vars(soundtrack).pop('bot', None)
+            asyncio.set_event_loop(None)
+            loop.close()
+
+
+def test_voice_state_update(bot, monkeypatch):
+    monkeypatch.setitem(bot.config, 'idle_timeout', TIMEOUT)
+    async def run():
+        listener = member()
+        player = players[1] = connected_player(member(bot=True), listener)
+        try:
+            player.voice_client.channel.members.remove(listener)
+            await bot.on_voice_state_update(listener, None, None)
+            assert player._idle_task != None
+            player.voice_client.channel.members.append(listener)
+            await bot.on_voice_state_update(listener, None, None)
+            assert player._idle_task == None
+            player.voice_client.channel.members.remove(listener)
+            await bot.on_voice_state_update(listener, None, None)
+            await asyncio.sleep(TIMEOUT * 2)
+            assert player.voice_client.disconnected
+        finally:
+            players.pop(1, None)
+    asyncio.run(run())
@@ -0,0 +1,41 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+""" Tests for the track index """
+import pytest
+
+from soundtrack.internal.index import TrackIndex, SqliteTrackIndex
+
+
+def entry(name: str):
+    return {'intro': f'{name}-intro.mp3', 'loop': f'{name}-loop.mp3', 'delay': 0}
+
+
+def test_rename(tmp_path):
+    index = SqliteTrackIndex(str(tmp_path / 'index.db'))
+    index['Old'] = entry('a')
+    index.rename('Old', 'New')
+    assert 'Old' not in index and index['New'] == entry('a')
+    assert index.refs('a-intro.mp3') == 1
+    index.close()
+    index = SqliteTrackIndex(str(tmp_path / 'index.db'))
+    assert dict(index.items()) == {'New': entry('a')}
+
+
+def test_rename_to_same_title(tmp_path):
+    index = SqliteTrackIndex(str(tmp_path / 'index.db'))
+    index['Title'] = entry('a')
+    index.rename('Title', 'Title')
+    assert index['Title'] == entry('a')
+    assert index.refs('a-intro.mp3') == 1
+    assert index.refs('a-loop.mp3') == 1
+
+
+def test_incomplete_backend():
+    class ReadOnlyIndex(TrackIndex):
+        def _load(self):
+            return {}
+
+    with pytest.raises(TypeError):
+        ReadOnlyIndex()
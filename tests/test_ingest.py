@@ -0,0 +1,58 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+""" Tests for preparing uploaded track files """
+import pytest
+
+from soundtrack.internal import ingest, transcode
+from soundtrack.internal.loudness import gain_for
+
+LOUDNESS = {'integrated': -20.0, 'peak': -6.0}
+
+
+@pytest.fixture
+def track(tmp_path, monkeypatch):
+    """ A stored track file, with FFmpeg replaced by recording what it would have done """
+    path = tmp_path / 'track.mp3'
+    path.write_bytes(b'ID3')
+    calls = {'measure': 0, 'transcode': []}
+    def measure(path):
+        calls['measure'] += 1
+        return dict(LOUDNESS)
+    def encode(path, audio_filter=None):
+        calls['transcode'].append(audio_filter)
+        out = transcode.opus_path(path)
+        open(out, 'wb').close()
+        return out
+    monkeypatch.setattr(ingest, 'probe', lambda path: {'codec': 'mp3', 'sample_rate': 48000, 'duration': 1.0})
+    monkeypatch.setattr(ingest, 'measure', measure)
+    monkeypatch.setattr(transcode, 'transcode', encode)
+    return str(path), calls
+
+
+def test_prepare_new_file(track):
+    path, calls = track
+    info = ingest.prepare(path, normalize=True)
+    assert calls['measure'] == 1
+    assert calls['transcode'] == [f'volume={gain_for(LOUDNESS)}dB']
+    assert info['loudness'] == LOUDNESS | {'gain': gain_for(LOUDNESS)}
+
+
+def test_prepare_stored_file(track):
+    path, calls = track
+    ingest.prepare(path, normalize=True)
+    measured = LOUDNESS | {'gain': gain_for(LOUDNESS)}
+    info = ingest.prepare(path, normalize=True, measured=measured)
+    assert calls['measure'] == 1
+    assert len(calls['transcode']) == 1
+    assert info['loudness'] == measured
+
+
+def test_prepare_stored_file_with_other_gain(track):
+    path, calls = track
+    ingest.prepare(path, normalize=False)
+    info = ingest.prepare(path, normalize=True, measured=LOUDNESS | {'gain': 0.0})
+    assert calls['measure'] == 1
+    assert calls['transcode'] == [None, f'volume={gain_for(LOUDNESS)}dB']
+    assert info['loudness']['gain'] == gain_for(LOUDNESS)
@@ -0,0 +1,39 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+""" Tests for checking track files """
+from soundtrack.internal.integrity import IntegrityScanner, MISSING, EMPTY
+
+
+def entry(*paths):
+    return {'intro': paths[0], 'loop': paths[-1], 'delay': 0}
+
+
+def test_scan(tmp_path):
+    good, empty = tmp_path / 'good.mp3', tmp_path / 'empty.mp3'
+    good.write_bytes(b'ID3')
+    empty.write_bytes(b'')
+    missing = tmp_path / 'missing.mp3'
+    scanner = IntegrityScanner()
+    problems = scanner.scan([str(good), str(empty), str(missing)])
+    assert problems == {str(empty): EMPTY, str(missing): MISSING}
+    assert scanner.problem(entry(str(good))) == None
+    assert scanner.problem(entry(str(good), str(missing))) == MISSING
+
+
+def test_update_during_scan(tmp_path):
+    path = str(tmp_path / 'track.mp3')
+    scanner = IntegrityScanner()
+    check = scanner.check
+    def check_then_upload(path, checksum=False):
+        scanner.check = check
+        problem = check(path, checksum)
+        # Uploaded again while the scan is still running
+        with open(path, 'wb') as file:
+            file.write(b'ID3')
+        scanner.update([path])
+        return problem
+    scanner.check = check_then_upload
+    assert scanner.scan([path]) == {path: MISSING}
+    assert scanner.problem(entry(path)) == None
@@ -0,0 +1,48 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+""" Tests for importing soundtracks """
+import pytest
+
+from soundtrack.internal import library
+from soundtrack.internal.index import SqliteTrackIndex
+
+
+@pytest.fixture
+def source(tmp_path, monkeypatch):
+    """ A directory with a different track file per name, imported without probing or encoding them """
+    monkeypatch.setattr(library, 'prepare', lambda path, normalize=False, measured=None: {'loudness': None})
+    folder = tmp_path / 'source'
+    folder.mkdir()
+    def track(name: str):
+        path = folder / f'{name}.mp3'
+        path.write_bytes(name.encode())
+        return str(path)
+    return track
+
+
+def entry(track, phases: list = ()):
+    return {'intro': track('intro'), 'loop': track('loop'), 'delay': 0, 'phases': {name: track(f'phase{i}') for i, name in enumerate(phases)}}
+
+
+def test_import_checks_phases(tmp_path, source):
+    (tmp_path / 'tracks').mkdir()
+    index = SqliteTrackIndex(str(tmp_path / 'index.db'))
+    entries = {
+        'Good': entry(source, ['Calm', 'Combat']),
+        'Main': entry(source, ['Main Loop']),
+        'Characters': entry(source, ['Calm-ish']),
+        'Short': entry(source, ['Hi']),
+        'Many': entry(source, [f'Phase {i}' for i in range(library.MAX_PHASES + 1)]),
+    }
+    imported, skipped = library.import_library(index, entries, str(tmp_path / 'tracks'))
+    assert imported == ['Good']
+    assert set(index['Good']['phases']) == {'Calm', 'Combat'}
+    assert skipped == {
+        'Main': 'invalid phase name: Main Loop',
+        'Characters': 'invalid phase name: Calm-ish',
+        'Short': 'invalid phase name: Hi',
+        'Many': f'more than {library.MAX_PHASES} phases',
+    }
+    index.close()
@@ -0,0 +1,198 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+""" Tests for the guild player """
+import time
+import asyncio
+
+import nextcord
+
+from soundtrack.internal import player as player_module
+from soundtrack.internal.audio import BufferedAudio, PlaybackStats
+from soundtrack.internal.player import GuildPlayer
+
+
+class FrameAudio(nextcord.AudioSource):
+    """ Opus source of `frames` silent frames, counting reads and cleanups """
+    def __init__(self, frames: int):
+        self.frames = frames
+        self.reads = 0
+        self.cleaned = 0
+
+    def read(self):
+        self.reads += 1
+        if self.reads > self.frames:
+            return b''
+        return b'\xf8\xff\xfe'
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        self.cleaned += 1
+
+
+class FakeVoiceClient:
+    """ Stands in for `nextcord.VoiceClient` playing `source`, still playing after a swap if `playing` """
+    def __init__(self, source, playing: bool):
+        self._source = source
+        self.playing = True
+        self.after_swap = playing
+        self.encoder = True # no Opus library needed
+
+    @property
+    def source(self):
+        return self._source
+
+    @source.setter
+    def source(self, source):
+        self._source = source
+        self.playing = self.after_swap
+
+    def is_playing(self):
+        return self.playing
+
+
+def crossfade(playing: bool):
+    old, new = FrameAudio(100), FrameAudio(100)
+    buffered = BufferedAudio(old, PlaybackStats())
+    buffered.read()
+    player = GuildPlayer(1)
+    player.voice_client = FakeVoiceClient(buffered, playing)
+    player._waiter = [None]
+    swapped = player._crossfade(new, 1.0, None)
+    time.sleep(0.05)
+    return player, swapped, buffered, new
+
+
+def test_crossfade_reads_nothing_until_played():
+    player, swapped, buffered, new = crossfade(playing=True)
+    assert swapped
+    assert player.voice_client.source is not buffered
+    # The crossfade only starts taking frames from the old source when the voice client reads it
+    assert new.reads == 0
+    assert len(buffered._buffer) > 0
+    player.voice_client.source.cleanup()
+
+
+def test_crossfade_after_end_leaves_source():
+    player, swapped, buffered, new = crossfade(playing=False)
+    assert not swapped
+    assert player.voice_client.source._stopped
+    assert new.reads == 0 and new.cleaned == 0
+    buffered.cleanup()
+
+
+class FakeChain:
+    """ Stands in for the `ChainAudio` of the current soundtrack """
+    def __init__(self):
+        self.following = None
+
+    def follow(self, source):
+        self.following = source
+
+
+async def prepared_player(monkeypatch, queue: list):
+    """ A player whose current soundtrack has the first soundtrack of `queue` prepared to follow it """
+    monkeypatch.setattr(player_module, 'warm', lambda path, gain: True)
+    monkeypatch.setattr(player_module, 'SoundtrackAudio', lambda *args: object())
+    entries = {track: {'intro': f'{track}-intro.mp3', 'loop': f'{track}-loop.mp3', 'delay': 0} for track, loops in queue}
+    player = GuildPlayer(1)
+    player.lookup = lambda track: entries.get(track)
+    player.track = 'A'
+    player._chain = FakeChain()
+    for track, loops in queue:
+        player.enqueue(track, loops)
+    await player._preparing
+    return player, entries
+
+
+def test_advance_after_renaming_next(monkeypatch):
+    async def run():
+        player, entries = await prepared_player(monkeypatch, [('B', 1), ('C', None)])
+        entries['B2'] = entries.pop('B')
+        player.rename('B', 'B2')
+        await player._preparing
+        player._advanced(player._chain.following)
+        assert player.track == 'B2'
+        assert list(player.queue) == [('C', None)]
+    asyncio.run(run())
+
+
+def test_advance_after_deleting_next(monkeypatch):
+    async def run():
+        player, entries = await prepared_player(monkeypatch, [('B', 1), ('C', None)])
+        del entries['B']
+        player.discard('B')
+        await player._preparing
+        player._advanced(player._chain.following)
+        assert player.track == 'C'
+        assert list(player.queue) == []
+    asyncio.run(run())
+
+
+def test_advance_with_same_soundtrack_queued_twice(monkeypatch):
+    async def run():
+        player, entries = await prepared_player(monkeypatch, [('B', 1), ('B', 1)])
+        player._advanced(player._chain.following)
+        assert player.track == 'B'
+        assert list(player.queue) == [('B', 1)]
+    asyncio.run(run())
+
+
+class EndingVoiceClient:
+    """ Stands in for `nextcord.VoiceClient`, every source it plays ends right away """
+    def __init__(self):
+        self.encoder = True
+
+    def is_connected(self):
+        return True
+
+    def is_playing(self):
+        return False
+
+    def stop(self):
+        pass
+
+    def play(self, source, *, after=None):
+        source.cleanup()
+        after(None)
+
+
+def sequence(calls: list, name: str):
+    """ Makes sources like the FFmpeg fallback does, recording that it did in `calls` """
+    def make():
+        calls.append(name)
+        return FrameAudio(1)
+    return make
+
+
+def test_stop_during_delay():
+    async def run():
+        calls = []
+        player = GuildPlayer(1)
+        player.voice_client = EndingVoiceClient()
+        player.start_sequence('Title', sequence(calls, 'intro'), sequence(calls, 'loop'), 0.2)
+        await asyncio.sleep(0.1)
+        assert calls == ['intro']
+        player.stop()
+        await asyncio.sleep(0.2)
+        assert calls == ['intro']
+        assert not player.is_active()
+    asyncio.run(run())
+
+
+def test_play_during_delay():
+    async def run():
+        calls = []
+        player = GuildPlayer(1)
+        player.voice_client = EndingVoiceClient()
+        player.start_sequence('Old', sequence(calls, 'intro'), sequence(calls, 'loop'), 0.2)
+        await asyncio.sleep(0.1)
+        player.start_sequence('New', sequence(calls, 'new intro'), sequence(calls, 'new loop'), 1)
+        await asyncio.sleep(0.2)
+        assert calls == ['intro', 'new intro']
+        assert player.track == 'New'
+        player.stop()
+    asyncio.run(run())
@@ -0,0 +1,37 @@
+# 
+# Soundtrack 
+# Copyright (c) 2023 Krafter Developer
+# 
+""" Tests for track file storage """
+import sqlite3
+
+from soundtrack.internal.index import SqliteTrackIndex
+from soundtrack.internal.storage import release
+
+
+def test_release_writes_index_first(tmp_path):
+    intro, loop = tmp_path / 'intro.mp3', tmp_path / 'loop.mp3'
+    for path in (intro, loop):
+        path.write_bytes(b'ID3')
+    index = SqliteTrackIndex(str(tmp_path / 'index.db'), delay=60)
+    index['Title'] = {'intro': str(intro), 'loop': str(loop), 'delay': 0}
+    index.flush()
+    release(index, index.pop('Title'))
+    assert not intro.exists() and not loop.exists()
+    # Read by another connection, like after a restart
+    db = sqlite3.connect(tmp_path / 'index.db')
+    assert db.execute('SELECT COUNT(*) FROM tracks').fetchone() == (0,)
+    db.close()
+    index.close()
+
+
+def test_release_keeps_shared_files(tmp_path):
+    shared, loop = tmp_path / 'shared.mp3', tmp_path / 'loop.mp3'
+    for path in (shared, loop):
+        path.write_bytes(b'ID3')
+    index = SqliteTrackIndex(str(tmp_path / 'index.db'))
+    index['One'] = {'intro': str(shared), 'loop': str(loop), 'delay': 0}
+    index['Two'] = {'intro': str(shared), 'loop': str(shared), 'delay': 0}
+    release(index, index.pop('One'))
+    assert shared.exists() and not loop.exists()
+    index.close()